@@ -0,0 +1,383 @@
+import io
+import os
+import sys
+import re
+import gc
+import json
+import time
+import base64
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from datetime import datetime, timezone
+import processor
+import merger
+
+BENCH_FILE = "rulesets/block/domain/Loyalsoldier/reject-list.txt"
+REPEAT = 5
+SUITE_REPEAT = int(os.getenv("BENCH_REPEAT", "3"))
+SIZES = {"10k": 10_000, "100k": 100_000, "1M": 1_000_000, "5M": 5_000_000}
+DEFAULT_SIZES = "10k,100k,1M"
+SEED = 20240601
+TOLERANCE = float(os.getenv("BENCH_TOLERANCE", "0.15"))
+TLDS = ["com", "net", "org", "cn", "io", "co.uk", "com.cn", "dev", "app", "xyz"]
+
+def legacy_process_domain(lines):
+    """旧版逐前缀循环实现，仅作为基准对照"""
+    valid_domains = set()
+    ip_check = re.compile(r'^\d{1,3}(\.\d{1,3}){3}$')
+    prefixes = [
+        'full:', 'domain:', 'host:', 'keyword:', 'regexp:',
+        'domain-suffix:', 'domain-keyword:', '+.'
+    ]
+    for item in lines:
+        s = item.lower().strip()
+        if not s: continue
+        if s.startswith('@@'): continue
+        for prefix in prefixes:
+            if s.startswith(prefix):
+                s = s[len(prefix):]
+                break
+        parts = s.split()
+        if len(parts) >= 2:
+            if parts[0] in ['127.0.0.1', '0.0.0.0', '::1']:
+                s = parts[1]
+        if s.startswith('||'): s = s[2:]
+        if s.endswith('^'): s = s[:-1]
+        if '$' in s: s = s.split('$')[0]
+        s = re.sub(r'^(\*\.|\+\.|\.)', '', s)
+        if '/' in s: s = s.split('/')[0]
+        if ':' in s: s = s.split(':')[0]
+        if not s or '.' not in s: continue
+        if ' ' in s: continue
+        if ip_check.match(s): continue
+        if not all(c.isalnum() or c in '-._' for c in s): continue
+        valid_domains.add(s)
+    return sorted(list(valid_domains))
+
+def best_of(func, lines, repeat=REPEAT):
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(lines)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def serial_process_domain(lines):
+    return processor.process_domain(lines, workers=1)
+
+def parallel_process_domain(lines):
+    return processor.process_domain(lines, workers=processor.PARALLEL_WORKERS)
+
+def bench_process_domain(path=BENCH_FILE):
+    """
+    process_domain 微基准：新旧实现均为单进程的 lines/sec 对比，并校验输出一致
+    多进程 (PROCESSOR_WORKERS) 的收益单独一行列出，不计入新旧实现的加速比
+    """
+    with open(path, 'rb') as f:
+        lines = list(processor.parse_stream(processor.iter_chunks(f)))
+
+    t_old, res_old = best_of(legacy_process_domain, lines)
+    t_new, res_new = best_of(serial_process_domain, lines)
+    if res_old != list(res_new):
+        print("❌ Output mismatch between legacy and current process_domain")
+        sys.exit(1)
+
+    t_par = None
+    if processor.PARALLEL_WORKERS > 1:
+        t_par, res_par = best_of(parallel_process_domain, lines)
+        if res_par != res_new:
+            print("❌ Output mismatch between serial and parallel process_domain")
+            sys.exit(1)
+
+    n = len(lines)
+    print(f"📄 {path} ({n} lines, best of {REPEAT})")
+    print(f"| Implementation | Time | Lines/sec |")
+    print(f"| :--- | ---: | ---: |")
+    print(f"| legacy  | {t_old:.3f}s | {n / t_old:,.0f} |")
+    print(f"| current | {t_new:.3f}s | {n / t_new:,.0f} |")
+    if t_par is not None:
+        print(f"| current, {processor.PARALLEL_WORKERS} workers | {t_par:.3f}s | {n / t_par:,.0f} |")
+    print(f"Speedup (single process): {t_old / t_new:.2f}x")
+    if t_par is not None:
+        print(f"Parallel speedup ({processor.PARALLEL_WORKERS} workers): {t_new / t_par:.2f}x")
+
+def random_domain(rng):
+    labels = rng.randint(1, 3)
+    name = ".".join("".join(rng.choices("abcdefghijklmnopqrstuvwxyz0123456789-", k=rng.randint(3, 12))).strip("-") or "x"
+                    for _ in range(labels))
+    return f"{name}.{rng.choice(TLDS)}"
+
+def domain_corpus(n, seed=SEED):
+    """混合写法的域名语料：hosts / AdGuard / full: / domain: / +. / 纯域名 / 注释，约 20% 重复"""
+    rng = random.Random(seed)
+    pool = [random_domain(rng) for _ in range(max(n * 4 // 5, 1))]
+    out = []
+    for _ in range(n):
+        d = rng.choice(pool)
+        r = rng.random()
+        if r < 0.30: out.append(d)
+        elif r < 0.45: out.append(f"0.0.0.0 {d}")
+        elif r < 0.60: out.append(f"||{d}^")
+        elif r < 0.70: out.append(f"full:{d}")
+        elif r < 0.80: out.append(f"domain:{d}")
+        elif r < 0.90: out.append(f"+.{d}")
+        elif r < 0.95: out.append(f"# comment {d}")
+        else: out.append("")
+    return out
+
+def ip_corpus(n, seed=SEED):
+    """v4 / v6 CIDR 混合语料，约 15% 为 IPv6，包含大量可合并的相邻网段"""
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        if rng.random() < 0.85:
+            plen = rng.choice([8, 12, 16, 20, 22, 24, 24, 24, 32])
+            addr = rng.getrandbits(32)
+            out.append(f"{addr >> 24}.{(addr >> 16) & 255}.{(addr >> 8) & 255}.{addr & 255}/{plen}")
+        else:
+            plen = rng.choice([32, 48, 56, 64])
+            hextets = [0x2400 + rng.randrange(0x400)] + [rng.getrandbits(16) for _ in range(3)]
+            out.append(":".join(f"{h:x}" for h in hextets) + f"::/{plen}")
+    return out
+
+def render_corpus(fmt, lines):
+    """把条目渲染为指定格式的原始文本 (text / yaml / base64)"""
+    text = "\n".join(lines)
+    if fmt == "yaml":
+        return "payload:\n" + "\n".join(f"  - '{l}'" for l in lines if l and not l.startswith("#"))
+    if fmt == "base64":
+        return base64.b64encode(text.encode()).decode()
+    return text
+
+def measure(func, arg_factory, repeat=SUITE_REPEAT, memory=True):
+    """
+    计时取最优值；另起一次在 tracemalloc 下运行，得到峰值内存与调用后新增的内存块数
+    arg_factory 每次返回新的参数，避免被上一次调用消耗的迭代器影响结果
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        args = arg_factory()
+        gc.collect()
+        t0 = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+        del result
+
+    peak_mb = blocks = None
+    if memory:
+        args = arg_factory()
+        gc.collect()
+        blocks_before = sys.getallocatedblocks()
+        tracemalloc.start()
+        result = func(*args)
+        peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+        blocks = sys.getallocatedblocks() - blocks_before
+        del result
+    return best, peak_mb, blocks
+
+def parse_all(raw):
+    return list(processor.parse_stream(processor.iter_chunks(io.BytesIO(raw))))
+
+def run_merge_task(workdir, inputs):
+    """在临时目录中执行 process_task_logic (真实读写文件)"""
+    merger.SOURCE_DIR = os.path.join(workdir, "src")
+    merger.OUTPUT_DIR = merger.STAGING_DIR = os.path.join(workdir, "out")
+    merger.INPUT_CACHE.clear()
+    return merger.process_task_logic("bench", "domain", "bench", "bench.txt", inputs, "benchmark")
+
+def write_inputs(workdir, lines, parts=3):
+    src = os.path.join(workdir, "src")
+    os.makedirs(src, exist_ok=True)
+    inputs = []
+    for i in range(parts):
+        name = f"part{i}.txt"
+        with open(os.path.join(src, name), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines[i::parts]))
+        inputs.append(name)
+    return inputs
+
+def bench_cases_synthetic(size_names):
+    """合成语料上的基准用例：产出 (函数, 语料, 条目数, 计时函数, 参数工厂)"""
+    for size_name in size_names:
+        n = SIZES[size_name]
+        domains = domain_corpus(n)
+        for fmt in ("text", "yaml", "base64"):
+            raw_text = render_corpus(fmt, domains)
+            raw = raw_text.encode()
+            yield "parse_lines", f"domain-{fmt}", n, processor.parse_lines, lambda t=raw_text: (t,)
+            yield "parse_stream", f"domain-{fmt}", n, parse_all, lambda r=raw: (r,)
+            del raw_text, raw
+        parsed = parse_all(render_corpus("text", domains).encode())
+        yield "process_domain", "domain-text", n, serial_process_domain, lambda p=parsed: (p,)
+        if processor.PARALLEL_WORKERS > 1:
+            yield "process_domain_parallel", "domain-text", n, parallel_process_domain, lambda p=parsed: (p,)
+        cleaned = list(serial_process_domain(parsed))
+        yield "prune_covered_domains", "domain-text", n, merger.prune_covered_domains, lambda c=cleaned: (set(c),)
+        del parsed
+
+        ips = ip_corpus(n)
+        yield "process_ip", "cidr", n, processor.process_ip, lambda l=ips: (l,)
+        yield "flatten_ip_cidr", "cidr", n, merger.flatten_ip_cidr, lambda l=ips: (set(l),)
+
+        workdir = tempfile.mkdtemp(prefix="bench-merge-")
+        try:
+            inputs = write_inputs(workdir, cleaned)
+            yield "process_task_logic", "domain-text", len(cleaned), run_merge_task, lambda w=workdir, i=inputs: (w, i)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        del domains, cleaned, ips
+
+def count_lines(path):
+    with open(path, "rb") as f:
+        return sum(1 for _ in f)
+
+def bench_cases_rulesets(root="rulesets"):
+    """仓库内 rulesets/ 上的基准用例 (离线)：逐文件解析清洗，再按 merge-config 执行合并任务"""
+    for dirpath, _, files in sorted(os.walk(root)):
+        for f in sorted(files):
+            if not f.endswith(".txt"):
+                continue
+            path = os.path.join(dirpath, f)
+            rel = os.path.relpath(path, root).replace(os.sep, "/")
+            with open(path, "rb") as fh:
+                raw = fh.read()
+            parsed = parse_all(raw)
+            yield "parse_stream", rel, len(parsed), parse_all, lambda r=raw: (r,)
+            if "ip" in rel.split("/")[1]:
+                yield "process_ip", rel, len(parsed), processor.process_ip, lambda p=parsed: (p,)
+                yield "flatten_ip_cidr", rel, len(parsed), merger.flatten_ip_cidr, lambda p=parsed: (set(p),)
+            else:
+                yield "process_domain", rel, len(parsed), serial_process_domain, lambda p=parsed: (p,)
+                if processor.PARALLEL_WORKERS > 1:
+                    yield "process_domain_parallel", rel, len(parsed), parallel_process_domain, lambda p=parsed: (p,)
+
+    workdir = tempfile.mkdtemp(prefix="bench-merge-")
+    try:
+        for t in merger.load_config_tasks():
+            def run(t=t):
+                merger.SOURCE_DIR = root
+                merger.OUTPUT_DIR = merger.STAGING_DIR = workdir
+                merger.INPUT_CACHE.clear()
+                return merger.process_task_logic(t['strategy'], t['type'], t['owner'], t['filename'],
+                                                 t['inputs'], "benchmark", prune=t.get('prune_subdomains', True))
+            n = sum(count_lines(os.path.join(root, i)) for i in t['inputs'])
+            yield "process_task_logic", t['filename'], n, run, lambda: ()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def run_suite(cases, memory=True):
+    results = {}
+    saved_dirs = (merger.SOURCE_DIR, merger.OUTPUT_DIR, merger.STAGING_DIR)
+    print(f"| Function | Corpus | Lines | Best | Lines/sec | Peak MB | Blocks |")
+    print(f"| :--- | :--- | ---: | ---: | ---: | ---: | ---: |")
+    try:
+        for func_name, corpus, n, func, arg_factory in cases:
+            best, peak_mb, blocks = measure(func, arg_factory, memory=memory)
+            key = f"{func_name}|{corpus}|{n}"
+            results[key] = {
+                "function": func_name, "corpus": corpus, "lines": n,
+                "seconds": round(best, 6),
+                "lines_per_sec": round(n / best) if best > 0 else None,
+                "peak_mb": round(peak_mb, 2) if peak_mb is not None else None,
+                "blocks": blocks,
+            }
+            r = results[key]
+            peak = f"{r['peak_mb']:.1f}" if r['peak_mb'] is not None else "-"
+            print(f"| {func_name} | {corpus} | {n:,} | {best:.3f}s | {r['lines_per_sec'] or 0:,} | {peak} | {blocks if blocks is not None else '-'} |")
+            sys.stdout.flush()
+    finally:
+        merger.SOURCE_DIR, merger.OUTPUT_DIR, merger.STAGING_DIR = saved_dirs
+    return results
+
+def save_baseline(path, results):
+    data = {
+        "meta": {
+            "generated_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed": SEED,
+        },
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"💾 Baseline saved to {path}")
+
+def compare_baseline(path, results):
+    """与基线对比：吞吐下降或峰值内存上升超过 BENCH_TOLERANCE 视为退化，返回退化条目数"""
+    with open(path, "r", encoding="utf-8") as f:
+        baseline = json.load(f).get("results", {})
+    regressions = 0
+    print(f"\n| Function | Corpus | Lines | Lines/sec (base → now) | Δ | Peak MB (base → now) |")
+    print(f"| :--- | :--- | ---: | ---: | ---: | ---: |")
+    for key, now in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        speed = now['lines_per_sec'] / base['lines_per_sec'] - 1 if base.get('lines_per_sec') else 0.0
+        mem_note = "-"
+        mem_worse = False
+        if base.get('peak_mb') and now.get('peak_mb') is not None:
+            mem_note = f"{base['peak_mb']:.1f} → {now['peak_mb']:.1f}"
+            mem_worse = now['peak_mb'] > base['peak_mb'] * (1 + TOLERANCE)
+        flag = ""
+        if speed < -TOLERANCE or mem_worse:
+            regressions += 1
+            flag = " ⚠️"
+        print(f"| {now['function']} | {now['corpus']} | {now['lines']:,} | "
+              f"{base['lines_per_sec']:,} → {now['lines_per_sec']:,} | {speed:+.1%}{flag} | {mem_note} |")
+    print(f"\n{'❌' if regressions else '✅'} {regressions} regression(s) beyond ±{TOLERANCE:.0%}")
+    return regressions
+
+def run_bench_command(argv):
+    parser = argparse.ArgumentParser(prog="benchmark.py", description="Processor / merger hot path benchmarks")
+    parser.add_argument("mode", choices=["suite", "rulesets"],
+                        help="suite: 合成语料；rulesets: 仓库内 rulesets/ (离线)")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"合成语料规模，可选 {','.join(SIZES)} (默认 {DEFAULT_SIZES}；5M 耗时较长)")
+    parser.add_argument("--save", metavar="JSON", help="保存结果为基线")
+    parser.add_argument("--compare", metavar="JSON", help="与基线对比，出现退化时退出码为 1")
+    parser.add_argument("--no-memory", action="store_true", help="跳过 tracemalloc 内存测量 (更快)")
+    args = parser.parse_args(argv)
+
+    if args.mode == "suite":
+        size_names = [s.strip() for s in args.sizes.split(",") if s.strip()]
+        unknown = [s for s in size_names if s not in SIZES]
+        if unknown:
+            parser.error(f"unknown size(s): {', '.join(unknown)} (choose from {', '.join(SIZES)})")
+        cases = bench_cases_synthetic(size_names)
+    else:
+        if not os.path.exists("rulesets"):
+            print("rulesets/ not found! Run from the repository root.")
+            sys.exit(1)
+        cases = bench_cases_rulesets()
+
+    print(f"🏁 {args.mode} (best of {SUITE_REPEAT}, workers={processor.PARALLEL_WORKERS})")
+    results = run_suite(cases, memory=not args.no_memory)
+    if args.save:
+        save_baseline(args.save, results)
+    if args.compare and compare_baseline(args.compare, results):
+        sys.exit(1)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ("suite", "rulesets"):
+        run_bench_command(sys.argv[1:])
+        return
+    path = sys.argv[1] if len(sys.argv) > 1 else BENCH_FILE
+    if not os.path.exists(path):
+        print(f"File {path} not found!")
+        sys.exit(1)
+    bench_process_domain(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import os
+import re
+import time
+from pathlib import Path
+from collections import Counter
+from rich.console import Console
+from rich.table import Table
+from cidr import parse_cidr
+
+console = Console()
+MERGED_DIR = "merged-rules"
+PRIORITY = [p.strip() for p in os.getenv('CONFLICT_PRIORITY', 'block,direct,policy').split(',') if p.strip()]
+STRIP_MODE = os.getenv('STRIP_CONFLICTS', 'false').lower() == 'true'
+
+def policy_rank(policy):
+    """策略优先级：越靠前越优先，未列出的策略排在最后"""
+    return PRIORITY.index(policy) if policy in PRIORITY else len(PRIORITY)
+
+def split_rules(lines):
+    """合并输出的文本行 -> (头部注释行, 规则列表)"""
+    header, rules = [], []
+    for line in lines:
+        line = line.strip()
+        if not line: continue
+        if line.startswith('#'):
+            header.append(line)
+            continue
+        rules.append(line)
+    return header, rules
+
+def read_rules(path):
+    """读取合并输出：返回 (头部注释行, 规则列表)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return split_rules(f)
+
+def classify(path):
+    """merged-rules/<policy>/<type>/... 下的文件 -> 检查条目，层级不足时返回 None"""
+    parts = Path(os.path.relpath(path, MERGED_DIR)).parts
+    if len(parts) < 3:
+        return None
+    rule_type = 'ipcidr' if 'ip' in parts[1].lower() else 'domain'
+    return {"path": path, "policy": parts[0], "type": rule_type}
+
+def scan_merged():
+    """扫描 merged-rules/<policy>/<type>/... 下的全部规则文件"""
+    entries = []
+    if not os.path.exists(MERGED_DIR):
+        return entries
+    for root, _, files in os.walk(MERGED_DIR):
+        for file in files:
+            if file.startswith('.') or not file.endswith('.txt'):
+                continue
+            entry = classify(os.path.join(root, file))
+            if entry is not None:
+                entries.append(entry)
+    entries.sort(key=lambda e: e['path'])
+    return entries
+
+def domain_overlaps(files):
+    """后缀索引：逐级查找每个域名的父域，统计跨策略覆盖关系"""
+    index = {}
+    for fid, f in enumerate(files):
+        for d in f['rules']:
+            index.setdefault(d, []).append(fid)
+
+    pairs = Counter()
+    for fid, f in enumerate(files):
+        policy = f['policy']
+        removed = set()
+        for d in f['rules']:
+            hits = set()
+            name = d
+            while True:
+                owners = index.get(name)
+                if owners:
+                    for o in owners:
+                        if files[o]['policy'] != policy:
+                            hits.add(o)
+                dot = name.find('.')
+                if dot < 0: break
+                name = name[dot + 1:]
+            for o in hits:
+                pairs[(fid, o)] += 1
+                if policy_rank(files[o]['policy']) < policy_rank(policy):
+                    removed.add(d)
+        f['removed'] = removed
+    return pairs
+
+def to_ranges(rules):
+    """CIDR -> 按起点排序的 (start, end, 原文) 区间数组，按地址族分开"""
+    ranges = {4: [], 6: []}
+    for c in rules:
+        try:
+            version, start, end, _ = parse_cidr(c)
+        except ValueError:
+            continue
+        ranges[version].append((start, end, c))
+    for v in ranges:
+        ranges[v].sort()
+    return ranges
+
+def count_range_overlaps(a, b):
+    """双指针扫描两组有序区间：返回 a 中与 b 相交的条目数及被 b 完全包含的条目"""
+    overlap = 0
+    contained = set()
+    j = 0
+    for start, end, text in a:
+        while j < len(b) and b[j][1] < start:
+            j += 1
+        k = j
+        hit = False
+        while k < len(b) and b[k][0] <= end:
+            hit = True
+            if b[k][0] <= start and end <= b[k][1]:
+                contained.add(text)
+            k += 1
+        if hit:
+            overlap += 1
+    return overlap, contained
+
+def cidr_overlaps(files):
+    pairs = Counter()
+    for f in files:
+        f['ranges'] = to_ranges(f['rules'])
+        f['removed'] = set()
+    for fid, f in enumerate(files):
+        for oid, other in enumerate(files):
+            if fid == oid or f['policy'] == other['policy']:
+                continue
+            total = 0
+            for v in (4, 6):
+                n, contained = count_range_overlaps(f['ranges'][v], other['ranges'][v])
+                total += n
+                if policy_rank(other['policy']) < policy_rank(f['policy']):
+                    f['removed'] |= contained
+            if total:
+                pairs[(fid, oid)] += total
+    return pairs
+
+def strip_file(f, write=None):
+    """
+    从低优先级文件中剔除已被高优先级策略覆盖的条目，返回剔除数量
+    默认写回磁盘；write(path, text, kept) 可替换为写入内存 (单进程流水线)
+    """
+    kept = [r for r in f['rules'] if r not in f['removed']]
+    # 保持原计数字段的宽度 (合并输出的计数为定宽补零)
+    header = [re.sub(r'^(# Count:\s+)(\d+)', lambda m: m.group(1) + str(len(kept)).zfill(len(m.group(2))), h)
+              for h in f['header']]
+    text = "\n".join(header) + "\n" + "\n".join(kept) + "\n"
+    if write is not None:
+        write(f['path'], text, kept)
+    else:
+        with open(f['path'], 'w', encoding='utf-8') as out:
+            out.write(text)
+    return len(f['rules']) - len(kept)
+
+def find_conflicts(entries, strip=False, write=None):
+    """检查全部条目 (需已填入 header / rules)，返回 (重叠的文件对, {被剔除的文件: 数量})"""
+    rows = []
+    stripped = {}
+    for rule_type, finder in (('domain', domain_overlaps), ('ipcidr', cidr_overlaps)):
+        files = [e for e in entries if e['type'] == rule_type]
+        pairs = finder(files)
+        for (fid, oid), n in sorted(pairs.items(), key=lambda kv: (files[kv[0][0]]['path'], files[kv[0][1]]['path'])):
+            rows.append((rule_type, files[fid], files[oid], n))
+        if strip:
+            for f in files:
+                if f['removed']:
+                    stripped[f['path']] = strip_file(f, write)
+    return rows, stripped
+
+def print_report(entries, rows, stripped, duration):
+    table = Table(title="Cross-Policy Overlaps", header_style="bold magenta")
+    table.add_column("Type")
+    table.add_column("File", style="cyan")
+    table.add_column("Covered By", style="dim")
+    table.add_column("Overlaps", justify="right", style="yellow")
+    for rule_type, f, other, n in rows:
+        table.add_row(rule_type, os.path.relpath(f['path'], MERGED_DIR), os.path.relpath(other['path'], MERGED_DIR), str(n))
+    console.print(table)
+    console.print(f"[dim]Scanned {sum(len(e['rules']) for e in entries)} rules in {len(entries)} files ({duration:.2f}s)[/dim]")
+    for path, n in stripped.items():
+        console.print(f"[green]✂️ Stripped {n} lower-priority duplicates from {path}[/green]")
+
+    if os.getenv('GITHUB_STEP_SUMMARY'):
+        with open(os.getenv('GITHUB_STEP_SUMMARY'), 'a') as f:
+            f.write(f"### 🔎 Conflict Report: {len(rows)} overlapping file pairs ({duration:.2f}s)\n\n")
+            if rows:
+                f.write("| Type | File | Covered By | Overlaps |\n|---|---|---|---|\n")
+                for rule_type, a, b, n in rows:
+                    f.write(f"| {rule_type} | `{os.path.relpath(a['path'], MERGED_DIR)}` | `{os.path.relpath(b['path'], MERGED_DIR)}` | **{n}** |\n")
+            else:
+                f.write("✅ No cross-policy overlaps.\n")
+            if stripped:
+                f.write(f"\n_Priority `{' > '.join(PRIORITY)}`: stripped " + ", ".join(f"`{os.path.relpath(p, MERGED_DIR)}` (-{n})" for p, n in stripped.items()) + "_\n")
+            f.write("\n")
+
+def main():
+    console.rule("[bold blue]🔎 Cross-Policy Conflict Check[/bold blue]")
+    start = time.time()
+
+    entries = scan_merged()
+    if not entries:
+        console.print(f"[yellow]⚠️ No merged files found in '{MERGED_DIR}'.[/yellow]")
+        return
+
+    for e in entries:
+        e['header'], e['rules'] = read_rules(e['path'])
+
+    rows, stripped = find_conflicts(entries, STRIP_MODE)
+    print_report(entries, rows, stripped, time.time() - start)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import ipaddress
+from array import array
+from itertools import groupby
+
+V4_BITS = 32
+V6_BITS = 128
+V4_MASK = (1 << V4_BITS) - 1
+HEX_DIGITS = frozenset('0123456789abcdefABCDEF')
+V4_MAPPED = (0xFFFF << 32, (0xFFFF << 32) | V4_MASK)
+
+def parse_ipv4_cidr(s):
+    """
+    快速解析 IPv4 CIDR 为 (start, end) 整数区间 (等价于 strict=False)
+    只接受 ipaddress 同样接受的写法，其余返回 None 交给 ipaddress 处理
+    """
+    addr, sep, plen = s.partition('/')
+    if sep:
+        if not (plen.isascii() and plen.isdigit()): return None
+        prefixlen = int(plen)
+        if prefixlen > V4_BITS: return None
+    else:
+        prefixlen = V4_BITS
+
+    octets = addr.split('.')
+    if len(octets) != 4: return None
+    value = 0
+    for o in octets:
+        if not o or len(o) > 3 or not (o.isascii() and o.isdigit()): return None
+        if o != '0' and o[0] == '0': return None
+        n = int(o)
+        if n > 255: return None
+        value = (value << 8) | n
+
+    host_bits = V4_BITS - prefixlen
+    start = (value >> host_bits) << host_bits
+    return start, start | ((1 << host_bits) - 1), prefixlen
+
+def parse_ipv6_int(s):
+    """快速解析纯十六进制写法的 IPv6 地址，规则与 ipaddress 相同；内嵌 IPv4 / 作用域等返回 None"""
+    if not s or '.' in s or '%' in s: return None
+    parts = s.split(':')
+    if len(parts) < 3 or len(parts) > 9: return None
+
+    skip_index = None
+    for i in range(1, len(parts) - 1):
+        if not parts[i]:
+            if skip_index is not None: return None
+            skip_index = i
+
+    if skip_index is not None:
+        parts_hi = skip_index
+        parts_lo = len(parts) - skip_index - 1
+        if not parts[0]:
+            parts_hi -= 1
+            if parts_hi: return None
+        if not parts[-1]:
+            parts_lo -= 1
+            if parts_lo: return None
+        parts_skipped = 8 - (parts_hi + parts_lo)
+        if parts_skipped < 1: return None
+    else:
+        if len(parts) != 8 or not parts[0] or not parts[-1]: return None
+        parts_hi, parts_lo, parts_skipped = 8, 0, 0
+
+    value = 0
+    for i, part in enumerate(parts[:parts_hi] + parts[len(parts) - parts_lo:]):
+        if not part or len(part) > 4 or not HEX_DIGITS.issuperset(part): return None
+        if i == parts_hi:
+            value <<= 16 * parts_skipped
+        value = (value << 16) | int(part, 16)
+    if parts_lo == 0:
+        value <<= 16 * parts_skipped
+    return value
+
+def parse_ipv6_cidr(s):
+    """快速解析 IPv6 CIDR 为 (start, end, prefixlen)，无法确定时返回 None"""
+    addr, sep, plen = s.partition('/')
+    if sep:
+        if '/' in plen or not (plen.isascii() and plen.isdigit()): return None
+        prefixlen = int(plen)
+        if prefixlen > V6_BITS: return None
+    else:
+        prefixlen = V6_BITS
+    value = parse_ipv6_int(addr)
+    if value is None: return None
+    host_bits = V6_BITS - prefixlen
+    start = (value >> host_bits) << host_bits
+    return start, start | ((1 << host_bits) - 1), prefixlen
+
+def format_ipv6(addr, prefixlen):
+    """与 str(IPv6Network) 相同的压缩格式；IPv4 映射段交给 ipaddress (各版本格式不同)"""
+    if V4_MAPPED[0] <= addr <= V4_MAPPED[1]:
+        return str(ipaddress.IPv6Network((addr, prefixlen)))
+    hextets = ['%x' % ((addr >> shift) & 0xFFFF) for shift in range(112, -1, -16)]
+    best_start, best_len = -1, 0
+    run_start, run_len = -1, 0
+    for i, h in enumerate(hextets):
+        if h == '0':
+            if run_start == -1: run_start = i
+            run_len += 1
+            if run_len > best_len:
+                best_start, best_len = run_start, run_len
+        else:
+            run_start, run_len = -1, 0
+    if best_len > 1:
+        best_end = best_start + best_len
+        if best_end == len(hextets):
+            hextets += ['']
+        hextets[best_start:best_end] = ['']
+        if best_start == 0:
+            hextets = [''] + hextets
+    return ':'.join(hextets) + f"/{prefixlen}"
+
+def parse_cidr(s):
+    """解析任意 CIDR：返回 (version, start, end, prefixlen)，非法时抛出 ValueError"""
+    if ':' not in s:
+        r = parse_ipv4_cidr(s)
+        if r is not None:
+            return 4, r[0], r[1], r[2]
+    else:
+        r = parse_ipv6_cidr(s)
+        if r is not None:
+            return 6, r[0], r[1], r[2]
+    net = ipaddress.ip_network(s, strict=False)
+    start = int(net.network_address)
+    return net.version, start, start + net.num_addresses - 1, net.prefixlen
+
+class RangeSet:
+    """整数区间集合：IPv4 以 start<<32|end 打包进 array('Q')，IPv6 用 (start, end) 元组"""
+
+    def __init__(self):
+        self.v4 = array('Q')
+        self.v6 = []
+
+    def add(self, version, start, end):
+        if version == 4:
+            self.v4.append((start << V4_BITS) | end)
+        else:
+            self.v6.append((start, end))
+
+    def merged_v4(self):
+        packed = array('Q', sorted(self.v4))
+        return merge_sorted_ranges(((p >> V4_BITS, p & V4_MASK) for p in packed))
+
+    def merged_v6(self):
+        return merge_sorted_ranges(sorted(self.v6))
+
+    def to_cidrs(self):
+        """输出最小 CIDR 列表，与 ipaddress.collapse_addresses 结果一致 (先 v4 后 v6)"""
+        result = []
+        for start, end in self.merged_v4():
+            result.extend(iter_prefix_strings(4, start, end))
+        for start, end in self.merged_v6():
+            result.extend(iter_prefix_strings(6, start, end))
+        return result
+
+def iter_prefix_strings(version, start, end):
+    if version == 4:
+        for addr, plen in range_to_prefixes(start, end, V4_BITS):
+            yield f"{addr >> 24}.{(addr >> 16) & 255}.{(addr >> 8) & 255}.{addr & 255}/{plen}"
+    else:
+        for addr, plen in range_to_prefixes(start, end, V6_BITS):
+            yield format_ipv6(addr, plen)
+
+def iter_collapsed(ranges):
+    """
+    流式版本的 to_cidrs：输入为按 (version, start) 排序的 (version, start, end)，
+    逐段合并并产出最小 CIDR，内存占用与输入规模无关
+    """
+    for version, group in groupby(ranges, key=lambda r: r[0]):
+        for start, end in iter_merged_ranges((s, e) for _, s, e in group):
+            yield from iter_prefix_strings(version, start, end)
+
+def iter_merged_ranges(ranges):
+    """合并按起点排序的区间，重叠与相邻区间合为一段 (逐段产出)"""
+    cur_start = cur_end = None
+    for start, end in ranges:
+        if cur_start is None:
+            cur_start, cur_end = start, end
+        elif start <= cur_end + 1:
+            if end > cur_end: cur_end = end
+        else:
+            yield cur_start, cur_end
+            cur_start, cur_end = start, end
+    if cur_start is not None:
+        yield cur_start, cur_end
+
+def merge_sorted_ranges(ranges):
+    """合并按起点排序的区间，返回列表"""
+    return list(iter_merged_ranges(ranges))
+
+def range_to_prefixes(start, end, bits):
+    """把连续区间拆成最少的对齐前缀块"""
+    while start <= end:
+        align = (start & -start).bit_length() - 1 if start else bits
+        span = (end - start + 1).bit_length() - 1
+        size = min(align, span)
+        yield start, bits - size
+        start += 1 << size
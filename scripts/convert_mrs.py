@@ -1,4 +1,5 @@
 import os
+import re
 import sys
 import shutil
 import subprocess
@@ -7,11 +8,24 @@ import requests
 import gzip
 import json
 import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import mrs
+import instrument
 
 SRC_ROOT = "merged-rules"
 DST_ROOT = "merged-rules-mrs"
 REPO_API = "https://api.github.com/repos/MetaCubeX/mihomo/releases/latest"
-KERNEL_BIN = "./mihomo"
+PINNED_URL = "https://github.com/MetaCubeX/mihomo/releases/download/{tag}/mihomo-linux-amd64-{tag}.gz"
+TAG_API = "https://api.github.com/repos/MetaCubeX/mihomo/releases/tags/{tag}"
+KERNEL_BIN = os.getenv("MIHOMO_BIN", "./mihomo")
+KERNEL_CACHE_DIR = os.getenv("MIHOMO_CACHE_DIR", os.path.join(".cache", "mihomo"))
+PINNED_VERSION = os.getenv("MIHOMO_VERSION", "").strip()
+OFFLINE_MODE = os.getenv("MIHOMO_OFFLINE", "false").lower() == "true"
+BUILD_CACHE_FILE = os.path.join(".cache", "mrs-cache.json")
+MAX_JOBS = int(os.getenv("MRS_JOBS", str(os.cpu_count() or 1)))
+BACKEND = os.getenv("MRS_BACKEND", "mihomo").lower()
+NATIVE_VERSION = "native-mrs1"
 
 class C:
     HEADER = '\033[95m'
@@ -32,35 +46,149 @@ def log(msg, type="info"):
     elif type == "group": print(f"::group::{msg}")
     elif type == "endgroup": print("::endgroup::")
 
-def get_latest_mihomo():
-    log("Fetching latest Mihomo release info...", "group")
+def api_headers():
     headers = {}
     if "GH_TOKEN" in os.environ:
         headers["Authorization"] = f"Bearer {os.environ['GH_TOKEN']}"
+    return headers
+
+def asset_sha256(asset):
+    """release asset 的 digest 字段 (sha256:<hex>)，未发布时返回 None"""
+    digest = asset.get('digest') or ""
+    return digest.split(":", 1)[1] if digest.startswith("sha256:") else None
 
+def published_sha256(tag_name, download_url):
+    """固定版本：按 tag 查询 release，取与下载地址对应的 asset 所发布的校验和"""
+    resp = requests.get(TAG_API.format(tag=tag_name), headers=api_headers())
+    resp.raise_for_status()
+    for asset in resp.json().get('assets', []):
+        if asset.get('browser_download_url') == download_url:
+            sha256 = asset_sha256(asset)
+            if not sha256:
+                raise Exception(f"Release {tag_name} publishes no checksum for {asset['name']}")
+            return sha256
+    raise Exception(f"Release {tag_name} has no asset {download_url}")
+
+def fetch_release_info():
+    """查询最新 Mihomo 版本号与下载地址 (只请求一次 API，不下载内核)"""
+    log("Fetching latest Mihomo release info...", "group")
     try:
-        resp = requests.get(REPO_API, headers=headers)
+        resp = requests.get(REPO_API, headers=api_headers())
         resp.raise_for_status()
         data = resp.json()
         tag_name = data['tag_name']
         log(f"Latest version identified: {C.BOLD}{tag_name}{C.END}")
 
-        download_url = None
         for asset in data['assets']:
             if "linux-amd64" in asset['name'] and "compatible" not in asset['name'] and asset['name'].endswith(".gz"):
-                download_url = asset['browser_download_url']
-                break
-        
-        if not download_url:
-            raise Exception("No suitable linux-amd64 asset found.")
+                return {
+                    "tag_name": tag_name,
+                    "download_url": asset['browser_download_url'],
+                    "sha256": asset_sha256(asset),
+                }
+
+        raise Exception("No suitable linux-amd64 asset found.")
+    except Exception as e:
+        log(f"Failed to fetch release info: {e}", "err")
+        sys.exit(1)
+    finally:
+        log("", "endgroup")
+
+def probe_kernel_version(binary):
+    """从 `mihomo -v` 输出中提取版本号"""
+    out = subprocess.check_output([binary, "-v"], text=True).strip()
+    m = re.search(r"v\d+\.\d+\.\d+\S*", out)
+    return m.group(0) if m else out
+
+def resolve_release():
+    """确定内核版本：离线模式不联网，固定版本不查询 API，否则查询一次最新版本"""
+    if OFFLINE_MODE:
+        if not os.path.exists(KERNEL_BIN):
+            log(f"Offline mode: kernel binary {KERNEL_BIN} not found!", "err")
+            sys.exit(1)
+        tag_name = PINNED_VERSION or probe_kernel_version(KERNEL_BIN)
+        log(f"Offline mode: using local kernel {KERNEL_BIN} ({tag_name})")
+        return {"tag_name": tag_name, "download_url": None, "sha256": None, "offline": True}
+
+    if PINNED_VERSION:
+        # 校验和在缓存未命中、需要下载时才按 tag 查询 (见 download_kernel)，命中缓存时不访问 API
+        log(f"Pinned version: {C.BOLD}{PINNED_VERSION}{C.END}")
+        return {
+            "tag_name": PINNED_VERSION,
+            "download_url": PINNED_URL.format(tag=PINNED_VERSION),
+            "sha256": None,
+            "pinned": True,
+        }
+
+    return fetch_release_info()
 
-        log(f"Downloading kernel from: {download_url}")
-        dl_resp = requests.get(download_url, stream=True)
-        dl_resp.raise_for_status()
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
-        with gzip.GzipFile(fileobj=dl_resp.raw) as gz:
-            with open(KERNEL_BIN, "wb") as f:
-                shutil.copyfileobj(gz, f)
+def cached_kernel(tag_name):
+    """返回校验通过的缓存内核路径，校验失败或不存在时返回 None"""
+    binary = os.path.join(KERNEL_CACHE_DIR, tag_name, "mihomo")
+    checksum = binary + ".sha256"
+    if not (os.path.exists(binary) and os.path.exists(checksum)):
+        return None
+    with open(checksum, "r") as f:
+        expected = f.read().strip()
+    if file_sha256(binary) != expected:
+        log(f"Cached kernel {binary} failed checksum, re-downloading.", "warn")
+        return None
+    return binary
+
+def download_kernel(release):
+    """下载并校验内核压缩包，解压到按版本划分的缓存目录"""
+    tag_dir = os.path.join(KERNEL_CACHE_DIR, release['tag_name'])
+    os.makedirs(tag_dir, exist_ok=True)
+    gz_path = os.path.join(tag_dir, "mihomo.gz.part")
+    binary = os.path.join(tag_dir, "mihomo")
+
+    if release.get('pinned') and not release.get('sha256'):
+        release['sha256'] = published_sha256(release['tag_name'], release['download_url'])
+
+    log(f"Downloading kernel from: {release['download_url']}")
+    dl_resp = requests.get(release['download_url'], stream=True)
+    dl_resp.raise_for_status()
+    with open(gz_path, "wb") as f:
+        for chunk in dl_resp.iter_content(1024 * 1024):
+            f.write(chunk)
+
+    if release.get('sha256'):
+        actual = file_sha256(gz_path)
+        if actual != release['sha256']:
+            os.unlink(gz_path)
+            raise Exception(f"Checksum mismatch: expected {release['sha256']}, got {actual}")
+        log("Archive checksum verified.")
+
+    with gzip.open(gz_path, "rb") as gz:
+        with open(binary, "wb") as f:
+            shutil.copyfileobj(gz, f)
+    os.unlink(gz_path)
+
+    with open(binary + ".sha256", "w") as f:
+        f.write(file_sha256(binary) + "\n")
+    return binary
+
+def get_latest_mihomo(release):
+    log(f"Installing Mihomo {release['tag_name']}...", "group")
+    try:
+        if release.get('offline'):
+            source = KERNEL_BIN
+        else:
+            source = cached_kernel(release['tag_name'])
+            if source:
+                log(f"Using cached kernel: {source}")
+            else:
+                source = download_kernel(release)
+
+        if os.path.abspath(source) != os.path.abspath(KERNEL_BIN):
+            shutil.copyfile(source, KERNEL_BIN)
         
         st = os.stat(KERNEL_BIN)
         os.chmod(KERNEL_BIN, st.st_mode | stat.S_IEXEC)
@@ -74,6 +202,51 @@ def get_latest_mihomo():
     finally:
         log("", "endgroup")
 
+def load_build_cache():
+    """读取 MRS 构建缓存 (输出路径 -> 内容键)"""
+    try:
+        with open(BUILD_CACHE_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_build_cache(cache):
+    os.makedirs(os.path.dirname(BUILD_CACHE_FILE), exist_ok=True)
+    tmp_path = BUILD_CACHE_FILE + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp_path, BUILD_CACHE_FILE)
+
+def stream_digest(fileobj):
+    """规则正文哈希：忽略 # 注释头 (其中的 Date 每次运行都会变化)"""
+    h = hashlib.sha256()
+    for line in fileobj:
+        if line.lstrip().startswith(b"#"):
+            continue
+        h.update(line)
+    return h.hexdigest()
+
+def body_digest(filepath):
+    with open(filepath, 'rb') as f:
+        return stream_digest(f)
+
+def cache_key(digest, rule_type, version):
+    return hashlib.sha256(f"{digest}|{rule_type}|{version}".encode()).hexdigest()
+
+def remove_stale_outputs(expected):
+    """删除本次未产出也未复用的 .mrs 文件，以及空目录"""
+    for root, _, files in os.walk(DST_ROOT):
+        for f in files:
+            path = os.path.join(root, f)
+            if os.path.normpath(path) not in expected:
+                log(f"Removing stale output: {path}")
+                os.unlink(path)
+    for dirpath, _, _ in os.walk(DST_ROOT, topdown=False):
+        if dirpath != DST_ROOT and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
 def get_rule_type(path_parts):
     for part in path_parts:
         p = part.lower()
@@ -94,6 +267,31 @@ def has_valid_content(filepath):
     except:
         return False
 
+def convert_one(rule_type, src_path, dst_path):
+    """运行单个 convert-ruleset 子进程，返回 (是否成功, stderr)"""
+    cmd = [KERNEL_BIN, "convert-ruleset", rule_type, "text", src_path, dst_path]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+        return True, ""
+    except subprocess.CalledProcessError as e:
+        return False, e.stderr.strip() if e.stderr else "Unknown Error"
+    except OSError as e:
+        return False, str(e)
+
+def convert_native(rule_type, src_path, dst_path):
+    """纯 Python 编码器：无需内核与子进程，返回 (是否成功, 错误信息)"""
+    try:
+        mrs.write_mrs(rule_type, mrs.read_text_rules(src_path), dst_path)
+        return True, ""
+    except Exception as e:
+        return False, str(e)
+
+def timed_call(worker, *args):
+    """在工作线程/进程内计时，返回 (结果, 耗时)，父进程据此记录每个文件的转换时间"""
+    t0 = time.perf_counter()
+    result = worker(*args)
+    return result, time.perf_counter() - t0
+
 def write_summary(stats, total_time):
     if "GITHUB_STEP_SUMMARY" not in os.environ: return
     
@@ -107,6 +305,7 @@ def write_summary(stats, total_time):
         "| Metric | Count |",
         "| :--- | :--- |",
         f"| 🟢 **Success** | {stats['success']} |",
+        f"| ♻️ **Cached** | {stats['cached']} |",
         f"| 🔴 **Failed** | **{stats['failed']}** |",
         f"| 🟡 **Skipped** | {stats['skipped']} |",
         f"| 📦 **Total Files** | {stats['total']} |",
@@ -121,70 +320,111 @@ def write_summary(stats, total_time):
 
 def main():
     start_time = time.time()
-    get_latest_mihomo()
-
-    log(f"Starting Conversion Task: {SRC_ROOT} -> {DST_ROOT}", "group")
-    
-    if os.path.exists(DST_ROOT):
-        for filename in os.listdir(DST_ROOT):
-            file_path = os.path.join(DST_ROOT, filename)
-            try:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    shutil.rmtree(file_path)
-            except Exception as e:
-                print(f"Failed to delete {file_path}. Reason: {e}")
-    else:
-        os.makedirs(DST_ROOT)
 
     if not os.path.exists(SRC_ROOT):
         log(f"Source dir {SRC_ROOT} not found!", "err")
         sys.exit(1)
+    os.makedirs(DST_ROOT, exist_ok=True)
+
+    if BACKEND == "native":
+        if mrs.zstandard is None:
+            log("MRS_BACKEND=native requires the 'zstandard' package.", "err")
+            sys.exit(1)
+        release = None
+        version = NATIVE_VERSION
+        log("Using native Python MRS writer (no kernel needed).")
+    else:
+        with instrument.span("resolve_release"):
+            release = resolve_release()
+        version = release['tag_name']
+    build_cache = load_build_cache()
 
     files_map = []
     for root, _, files in os.walk(SRC_ROOT):
         for f in files:
             if f.endswith(".txt"):
                 files_map.append(os.path.join(root, f))
+    files_map.sort()
 
     total_files = len(files_map)
-    stats = {"success": 0, "failed": 0, "skipped": 0, "total": total_files}
-    
-    log(f"Found {total_files} text rules to process.")
+    stats = {"success": 0, "cached": 0, "failed": 0, "skipped": 0, "total": total_files}
 
+    jobs = []
     for idx, src_path in enumerate(files_map, 1):
         rel_path = os.path.relpath(src_path, SRC_ROOT)
-        prefix = f"[{idx}/{total_files}]"
-        
         path_parts = rel_path.split(os.sep)
         rule_type = get_rule_type(path_parts)
         
         dst_rel = os.path.splitext(rel_path)[0] + ".mrs"
         dst_path = os.path.join(DST_ROOT, dst_rel)
-        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
 
+        job = {"idx": idx, "rel_path": rel_path, "src": src_path, "dst": dst_path,
+               "dst_key": dst_rel.replace(os.sep, "/"), "rule_type": rule_type,
+               "skip": None, "cached": False, "key": None, "future": None}
         if not rule_type:
-            print(f"{C.WARNING}{prefix} SKIP: {rel_path} (Unknown Type){C.END}")
-            stats["skipped"] += 1
-            continue
+            job["skip"] = "Unknown Type"
+        elif not has_valid_content(src_path):
+            job["skip"] = "No Valid Rules"
+        else:
+            with instrument.span("digest"):
+                job["key"] = cache_key(body_digest(src_path), rule_type, version)
+            entry = build_cache.get(job["dst_key"])
+            job["cached"] = bool(entry) and entry.get("key") == job["key"] and os.path.exists(dst_path)
+        jobs.append(job)
 
-        if not has_valid_content(src_path):
-            print(f"{C.WARNING}{prefix} SKIP: {rel_path} (No Valid Rules){C.END}")
-            stats["skipped"] += 1
-            continue
+    pending = [j for j in jobs if not j["skip"] and not j["cached"]]
+    if not pending:
+        log("All outputs are up to date, skipping kernel download.", "succ")
+    elif release:
+        with instrument.span("kernel_download"):
+            get_latest_mihomo(release)
 
-        cmd = [KERNEL_BIN, "convert-ruleset", rule_type, "text", src_path, dst_path]
-        
-        try:
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
-            print(f"{C.GREEN}{prefix} OK: {rel_path} -> MRS{C.END}")
-            stats["success"] += 1
-        except subprocess.CalledProcessError as e:
-            err_msg = e.stderr.strip() if e.stderr else "Unknown Error"
-            print(f"{C.FAIL}{prefix} ERR: {rel_path}")
-            print(f"    └── Reason: {err_msg}{C.END}")
-            stats["failed"] += 1
+    log(f"Starting Conversion Task: {SRC_ROOT} -> {DST_ROOT}", "group")
+    log(f"Found {total_files} text rules to process. ({len(pending)} to convert, jobs: {MAX_JOBS})")
+
+    # 大文件优先调度，日志仍按原始序号输出
+    pending.sort(key=lambda j: os.path.getsize(j["src"]), reverse=True)
+    new_cache = {}
+    expected = set()
+    # 子进程转换用线程池即可；原生编码是 CPU 密集型，改用进程池
+    if release:
+        pool_cls, worker = ThreadPoolExecutor, convert_one
+    else:
+        pool_cls, worker = ProcessPoolExecutor, convert_native
+    with pool_cls(max_workers=max(MAX_JOBS, 1)) as pool:
+        for job in pending:
+            os.makedirs(os.path.dirname(job["dst"]), exist_ok=True)
+            job["future"] = pool.submit(timed_call, worker, job["rule_type"], job["src"], job["dst"])
+
+        for job in jobs:
+            prefix = f"[{job['idx']}/{total_files}]"
+            rel_path = job["rel_path"]
+            if job["skip"]:
+                print(f"{C.WARNING}{prefix} SKIP: {rel_path} ({job['skip']}){C.END}")
+                stats["skipped"] += 1
+                continue
+
+            if job["cached"]:
+                print(f"{C.CYAN}{prefix} CACHED: {rel_path} (unchanged){C.END}")
+                stats["cached"] += 1
+                ok, err_msg = True, ""
+            else:
+                (ok, err_msg), elapsed = job["future"].result()
+                instrument.record("convert", elapsed, key=rel_path)
+                if ok:
+                    print(f"{C.GREEN}{prefix} OK: {rel_path} -> MRS{C.END}")
+                    stats["success"] += 1
+                else:
+                    print(f"{C.FAIL}{prefix} ERR: {rel_path}")
+                    print(f"    └── Reason: {err_msg}{C.END}")
+                    stats["failed"] += 1
+
+            if ok:
+                expected.add(os.path.normpath(job["dst"]))
+                new_cache[job["dst_key"]] = {"key": job["key"], "version": version}
+
+    remove_stale_outputs(expected)
+    save_build_cache(new_cache)
 
     log("", "endgroup")
 
@@ -192,12 +432,15 @@ def main():
     duration = end_time - start_time
 
     write_summary(stats, duration)
+    instrument.count("converted", stats["success"])
+    instrument.count("cached", stats["cached"])
+    instrument.report("convert")
 
     if stats["failed"] > 0:
         log(f"❌ Task Failed! {stats['failed']} files could not be converted.", "err")
         sys.exit(1)
     else:
-        log(f"🎉 Task Finished Successfully. ({stats['success']} converted, {stats['skipped']} skipped)", "succ")
+        log(f"🎉 Task Finished Successfully. ({stats['success']} converted, {stats['cached']} cached, {stats['skipped']} skipped)", "succ")
         sys.exit(0)
 
 if __name__ == "__main__":
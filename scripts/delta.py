@@ -0,0 +1,168 @@
+import os
+import json
+import threading
+from cidr import parse_cidr
+from domainset import DomainSet
+
+DELTA_DIR = os.getenv("DELTA_DIR", os.path.join(".cache", "delta"))
+# 为每个有变化的文件额外写出增量文件 (+规则 / -规则)，客户端可据此在旧列表上打补丁
+DELTA_FILES = os.getenv("DELTA_FILES", "false").lower() == "true"
+SUMMARY_LIMIT = 30
+
+_lock = threading.Lock()
+_entries = []
+
+class Unsorted(Exception):
+    """输入不是有序的，改用集合差集"""
+
+def cidr_key(rule):
+    """IP 规则的排序键，与 process_ip / flatten_ip_cidr 的输出顺序一致 (先 v4 后 v6，按起点)"""
+    version, start, end, _ = parse_cidr(rule)
+    return version, start, end
+
+def read_rules(path):
+    """逐行读取规则文件 (跳过注释与空行)，文件不存在时视为空"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+
+def same_content(path, rules):
+    """快速路径：旧文件与新规则逐字节相同 (重新解析但结果未变的常见情况)"""
+    try:
+        if os.path.getsize(path) == 0:
+            return not rules
+        with open(path, 'rb') as f:
+            new = rules.to_bytes() if isinstance(rules, DomainSet) else '\n'.join(rules).encode('utf-8')
+            return f.read() == new
+    except OSError:
+        return False
+
+def _keyed(rules, key):
+    prev = None
+    for rule in rules:
+        k = (key(rule), rule) if key else rule
+        if prev is not None and k <= prev:
+            if k == prev: continue
+            raise Unsorted()
+        prev = k
+        yield k, rule
+
+def sorted_diff(old, new, key=None):
+    """
+    双指针归并两个有序规则序列，逐条产出 ('+', rule) / ('-', rule)
+    key 为排序键 (默认按字符串)，任一侧出现乱序时抛出 Unsorted
+    """
+    old_it, new_it = _keyed(old, key), _keyed(new, key)
+    o, n = next(old_it, None), next(new_it, None)
+    while o is not None and n is not None:
+        if o[0] == n[0]:
+            o, n = next(old_it, None), next(new_it, None)
+        elif o[0] < n[0]:
+            yield '-', o[1]
+            o = next(old_it, None)
+        else:
+            yield '+', n[1]
+            n = next(new_it, None)
+    while o is not None:
+        yield '-', o[1]
+        o = next(old_it, None)
+    while n is not None:
+        yield '+', n[1]
+        n = next(new_it, None)
+
+def set_diff(old, new):
+    """无序输入的回退路径：集合差集，按字符串排序输出"""
+    old, new = set(old), set(new)
+    for rule in sorted(old - new):
+        yield '-', rule
+    for rule in sorted(new - old):
+        yield '+', rule
+
+def _consume(ops, out):
+    added = removed = 0
+    for op, rule in ops:
+        if op == '+':
+            added += 1
+        else:
+            removed += 1
+        if out is not None:
+            out.write(f"{op}{rule}\n")
+    return added, removed
+
+def record(stage, rel_path, old_path, new_rules, key=None):
+    """
+    比较磁盘上的旧文件与新规则，记录增删数量，返回 (added, removed)
+    new_rules 为规则序列 (list / DomainSet)，或新文件的路径 (需要时会重新读取)
+    """
+    if not isinstance(new_rules, str) and same_content(old_path, new_rules):
+        return 0, 0
+
+    def new_iter():
+        return read_rules(new_rules) if isinstance(new_rules, str) else new_rules
+
+    delta_path = os.path.join(DELTA_DIR, stage, rel_path + ".delta") if DELTA_FILES else None
+    tmp_path = delta_path + ".tmp" if delta_path else None
+    if tmp_path:
+        os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+
+    for make_ops in (lambda: sorted_diff(read_rules(old_path), new_iter(), key),
+                     lambda: set_diff(read_rules(old_path), new_iter())):
+        out = open(tmp_path, 'w', encoding='utf-8') if tmp_path else None
+        try:
+            added, removed = _consume(make_ops(), out)
+            break
+        except (Unsorted, ValueError):
+            continue
+        finally:
+            if out is not None:
+                out.close()
+
+    if tmp_path:
+        if added or removed:
+            os.replace(tmp_path, delta_path)
+        else:
+            os.remove(tmp_path)
+    if added or removed:
+        with _lock:
+            _entries.append({"stage": stage, "path": rel_path, "added": added, "removed": removed,
+                             "delta": delta_path.replace(os.sep, "/") if delta_path else None})
+    return added, removed
+
+def report(stage):
+    """写出 JSON 报告 (DELTA_DIR/<stage>.json)，并在 GitHub Step Summary 中追加变化最大的文件"""
+    with _lock:
+        entries = sorted((e for e in _entries if e["stage"] == stage), key=lambda e: e["path"])
+    data = {
+        "stage": stage,
+        "changed_files": len(entries),
+        "added": sum(e["added"] for e in entries),
+        "removed": sum(e["removed"] for e in entries),
+        "files": entries,
+    }
+    try:
+        os.makedirs(DELTA_DIR, exist_ok=True)
+        with open(os.path.join(DELTA_DIR, f"{stage}.json"), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+    except OSError:
+        pass
+
+    if os.getenv("GITHUB_STEP_SUMMARY"):
+        lines = [f"#### 🔀 Delta: {stage} ({data['changed_files']} files, "
+                 f"+{data['added']} / -{data['removed']})", ""]
+        if entries:
+            lines += ["| File | Added | Removed |", "| :--- | ---: | ---: |"]
+            top = sorted(entries, key=lambda e: -(e["added"] + e["removed"]))[:SUMMARY_LIMIT]
+            for e in top:
+                lines.append(f"| `{e['path']}` | +{e['added']} | -{e['removed']} |")
+            if len(entries) > SUMMARY_LIMIT:
+                lines.append(f"\n_... {len(entries) - SUMMARY_LIMIT} more in `{stage}.json`_")
+        else:
+            lines.append("_No rule changes._")
+        with open(os.getenv("GITHUB_STEP_SUMMARY"), "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n\n")
+    return data
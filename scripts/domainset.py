@@ -0,0 +1,136 @@
+from array import array
+from bisect import bisect_left
+from itertools import accumulate, groupby
+from operator import itemgetter
+
+ITER_BLOCK = 4096
+
+class DomainSet:
+    """
+    紧凑的有序域名集合：全部条目按 UTF-8 字节序排序后以 \\n 连接成一个 bytes，
+    另用 array 记录每条的起始偏移 (末尾多存一个哨兵)
+    每条只额外占用 4 字节偏移，set[str] 每条约 60~90 字节；字节序与 str 排序结果一致
+    """
+
+    __slots__ = ("blob", "offsets")
+
+    def __init__(self, blob=b"", offsets=None):
+        self.blob = blob
+        if offsets is None:
+            offsets = array('I', [0])
+        self.offsets = offsets
+
+    @classmethod
+    def from_unique_list(cls, items):
+        """
+        由已排序且无重复的字节串列表构建：join 与偏移累加都在 C 层完成
+        bytes.join 会为每个元素分配一个 Py_buffer (约 80 字节)，因此按块拼接，末尾追加空块得到结尾的换行
+        """
+        if not items:
+            return cls()
+        blocks = [b"\n".join(items[i:i + ITER_BLOCK]) for i in range(0, len(items), ITER_BLOCK)]
+        blocks.append(b"")
+        blob = b"\n".join(blocks)
+        del blocks
+        code = 'I' if len(blob) < (1 << 32) else 'Q'
+        return cls(blob, array(code, accumulate(map((1).__add__, map(len, items)), initial=0)))
+
+    @classmethod
+    def from_iterable(cls, items):
+        """任意 str / bytes 可迭代对象 -> 集合 (去重并排序)"""
+        keys = {i.encode("utf-8") if isinstance(i, str) else i for i in items}
+        keys.discard(b"")
+        return cls.from_unique_list(sorted(keys))
+
+    @classmethod
+    def union_of(cls, parts):
+        """
+        合并多个集合 (其它可迭代对象先转换为 DomainSet)
+        各部分本身有序，拼接后 timsort 只需归并这些有序段，去重用 groupby，全程在 C 层完成
+        """
+        parts = [p if isinstance(p, DomainSet) else cls.from_iterable(p) for p in parts]
+        parts = [p for p in parts if p]
+        if not parts:
+            return cls()
+        if len(parts) == 1:
+            return parts[0]
+        items = []
+        for p in parts:
+            items.extend(p.blob[:-1].split(b"\n"))
+        items.sort()
+        return cls.from_unique_list(list(map(itemgetter(0), groupby(items))))
+
+    def union(self, *others):
+        return DomainSet.union_of((self,) + others)
+
+    __or__ = union
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __bool__(self):
+        return len(self.offsets) > 1
+
+    def item_bytes(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("DomainSet index out of range")
+        return self.item_bytes(i).decode("utf-8")
+
+    def __contains__(self, item):
+        key = item.encode("utf-8") if isinstance(item, str) else item
+        i = bisect_left(_Keys(self), key)
+        return i < len(self) and self.item_bytes(i) == key
+
+    def iter_bytes(self, block=ITER_BLOCK):
+        """按块切分 blob 后逐条产出字节串，避免一次性生成全部对象"""
+        offsets = self.offsets
+        n = len(self)
+        for start in range(0, n, block):
+            end = min(start + block, n)
+            yield from self.blob[offsets[start]:offsets[end] - 1].split(b"\n")
+
+    def __iter__(self):
+        offsets = self.offsets
+        n = len(self)
+        for start in range(0, n, ITER_BLOCK):
+            end = min(start + ITER_BLOCK, n)
+            yield from self.blob[offsets[start]:offsets[end] - 1].decode("utf-8").split("\n")
+
+    def __eq__(self, other):
+        if isinstance(other, DomainSet):
+            return self.blob == other.blob
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.blob)
+
+    def __repr__(self):
+        return f"DomainSet({len(self)} entries, {len(self.blob)} bytes)"
+
+    @property
+    def nbytes(self):
+        """字节串与偏移数组的总大小"""
+        return len(self.blob) + self.offsets.itemsize * len(self.offsets)
+
+    def to_bytes(self):
+        """\\n 分隔的全部条目 (不含末尾换行)，与 '\\n'.join(list(self)) 的编码结果相同"""
+        return self.blob[:-1]
+
+class _Keys:
+    """给 bisect 用的只读视图：按下标返回字节串"""
+
+    __slots__ = ("ds",)
+
+    def __init__(self, ds):
+        self.ds = ds
+
+    def __len__(self):
+        return len(self.ds)
+
+    def __getitem__(self, i):
+        return self.ds.item_bytes(i)
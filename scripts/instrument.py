@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(".cache", "metrics"))
+TRACEMALLOC = os.getenv("INSTRUMENT_TRACEMALLOC", "false").lower() == "true"
+MB = 1024 * 1024
+
+_lock = threading.Lock()
+_local = threading.local()
+_spans = {}
+_events = []
+_counters = {}
+_state = {"started": time.perf_counter(), "rss_max": 0}
+
+if TRACEMALLOC:
+    tracemalloc.start()
+
+def current_rss():
+    """当前常驻内存 (字节)，仅 Linux 可用，其余平台返回 0"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+def peak_rss():
+    """进程生命周期内的峰值常驻内存 (字节)"""
+    peak = _state["rss_max"]
+    if resource is not None:
+        peak = max(peak, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+    return peak
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+def record(name, seconds, key=None, mem_delta=0):
+    """记录一次耗时 (外部测得的时长也可直接记入，例如子进程中的工作)"""
+    path = "/".join(_stack() + [name])
+    with _lock:
+        s = _spans.get(path)
+        if s is None:
+            s = _spans[path] = {"calls": 0, "total": 0.0, "max": 0.0, "mem_delta": 0}
+        s["calls"] += 1
+        s["total"] += seconds
+        s["max"] = max(s["max"], seconds)
+        s["mem_delta"] += mem_delta
+        if key is not None:
+            _events.append({"span": path, "key": key, "seconds": round(seconds, 6)})
+
+@contextmanager
+def span(name, key=None):
+    """计时区段：按嵌套路径 (parent/child) 聚合，key 用于记录单个源/文件的明细"""
+    mem_start = tracemalloc.get_traced_memory()[0] if TRACEMALLOC else 0
+    stack = _stack()
+    stack.append(name)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        stack.pop()
+        mem_delta = tracemalloc.get_traced_memory()[0] - mem_start if TRACEMALLOC else 0
+        rss = current_rss()
+        if rss > _state["rss_max"]:
+            _state["rss_max"] = rss
+        record(name, elapsed, key, mem_delta)
+
+def timed_iter(name, iterable, key=None):
+    """包装惰性迭代器：只累计 next() 内部的耗时，用于拆分流式解析与后续处理"""
+    it = iter(iterable)
+    path_stack = list(_stack())
+    elapsed = 0.0
+    try:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                elapsed += time.perf_counter() - t0
+                return
+            elapsed += time.perf_counter() - t0
+            yield item
+    finally:
+        stack = _stack()
+        saved = stack[:]
+        stack[:] = path_stack
+        record(name, elapsed, key)
+        stack[:] = saved
+
+def count(name, n=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+def export_state():
+    """取出并清空本进程累计的 spans / counters / events，用于工作进程把度量交回主进程 (见 merge_state)"""
+    with _lock:
+        data = {
+            "spans": {path: dict(s) for path, s in _spans.items()},
+            "counters": dict(_counters),
+            "events": list(_events),
+            "peak_rss": peak_rss(),
+        }
+        _spans.clear()
+        _counters.clear()
+        _events.clear()
+    return data
+
+def merge_state(data):
+    """把 export_state 的结果并入本进程，span 路径挂在当前所在的区段之下"""
+    prefix = "/".join(_stack())
+
+    def full(path):
+        return f"{prefix}/{path}" if prefix else path
+
+    with _lock:
+        for path, src in data["spans"].items():
+            s = _spans.get(full(path))
+            if s is None:
+                s = _spans[full(path)] = {"calls": 0, "total": 0.0, "max": 0.0, "mem_delta": 0}
+            s["calls"] += src["calls"]
+            s["total"] += src["total"]
+            s["max"] = max(s["max"], src["max"])
+            s["mem_delta"] += src["mem_delta"]
+        for name, n in data["counters"].items():
+            _counters[name] = _counters.get(name, 0) + n
+        _events.extend(dict(e, span=full(e["span"])) for e in data["events"])
+        _state["worker_rss_max"] = max(_state.get("worker_rss_max", 0), data["peak_rss"])
+
+def snapshot(stage):
+    wall = time.perf_counter() - _state["started"]
+    data = {
+        "stage": stage,
+        "generated_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "wall_seconds": round(wall, 4),
+        "peak_rss_mb": round(peak_rss() / MB, 2),
+        "worker_peak_rss_mb": round(_state.get("worker_rss_max", 0) / MB, 2),
+        "tracemalloc_peak_mb": round(tracemalloc.get_traced_memory()[1] / MB, 2) if TRACEMALLOC else None,
+        "spans": {},
+        "counters": dict(sorted(_counters.items())),
+        "events": list(_events),
+    }
+    with _lock:
+        for path in sorted(_spans):
+            s = _spans[path]
+            data["spans"][path] = {
+                "calls": s["calls"],
+                "total_seconds": round(s["total"], 6),
+                "avg_seconds": round(s["total"] / s["calls"], 6),
+                "max_seconds": round(s["max"], 6),
+                "mem_delta_mb": round(s["mem_delta"] / MB, 2) if TRACEMALLOC else None,
+            }
+    return data
+
+def report(stage):
+    """写出 JSON 报告 (METRICS_DIR/<stage>.json)，并在 GitHub Step Summary 中追加分阶段耗时表"""
+    data = snapshot(stage)
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"{stage}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+    except OSError:
+        pass
+
+    if os.getenv("GITHUB_STEP_SUMMARY") and data["spans"]:
+        mem_col = TRACEMALLOC
+        lines = [
+            f"#### ⏱️ Stage Breakdown: {stage} "
+            f"(wall {data['wall_seconds']:.2f}s, peak RSS {data['peak_rss_mb']:.1f} MB"
+            + (f", workers {data['worker_peak_rss_mb']:.1f} MB" if data["worker_peak_rss_mb"] else "") + ")",
+            "",
+            "| Span | Calls | Total | Avg | Max |" + (" ΔMem |" if mem_col else ""),
+            "| :--- | ---: | ---: | ---: | ---: |" + (" ---: |" if mem_col else ""),
+        ]
+        for path, s in data["spans"].items():
+            depth = path.count("/")
+            label = "&nbsp;&nbsp;" * depth + path.rsplit("/", 1)[-1]
+            row = (f"| {label} | {s['calls']} | {s['total_seconds']:.3f}s | "
+                   f"{s['avg_seconds'] * 1000:.1f}ms | {s['max_seconds'] * 1000:.1f}ms |")
+            if mem_col:
+                row += f" {s['mem_delta_mb']:.1f} MB |"
+            lines.append(row)
+        if data["counters"]:
+            lines.append("")
+            lines.append(", ".join(f"`{k}`: {v}" for k, v in data["counters"].items()))
+        with open(os.getenv("GITHUB_STEP_SUMMARY"), "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n\n")
+    return data
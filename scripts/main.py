@@ -1,18 +1,40 @@
+import io
 import os
 import sys
 import re
+import json
 import shutil
+import hashlib
 import logging
 import requests
 import subprocess
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timezone
+import cidr
 import processor
+import domainset
+from domainset import DomainSet
+import instrument
+import delta
 
 SOURCES_FILE = "sources.urls"
 RULESETS_DIR = Path("rulesets")
 TIMEOUT = 15
 RETRIES = 2
+MAX_WORKERS = int(os.getenv('SYNC_WORKERS', '8'))
+FETCH_CACHE_FILE = Path(".cache") / "fetch-cache.json"
+
+def code_version(*modules):
+    """清洗代码的版本：相关模块源码的哈希，清洗逻辑变化后缓存的输出随之失效"""
+    h = hashlib.sha256()
+    for m in modules:
+        with open(m.__file__, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+PROCESSOR_VERSION = code_version(processor, cidr, domainset)
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
@@ -21,6 +43,8 @@ class Statistics:
     def __init__(self):
         self.success = 0
         self.total_lines = 0
+        self.not_modified = 0
+        self.unchanged = 0
         self.download_errors = []
         self.parse_errors = []
 
@@ -51,18 +75,70 @@ def get_owner(url):
     else:
         return domain
 
-def download_content(url):
-    """下载内容，带重试机制"""
+def create_session():
+    """创建共享会话：按主机复用 keep-alive 连接池"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max(MAX_WORKERS, 1))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def load_fetch_cache():
+    """读取持久化的抓取清单 (URL -> ETag / Last-Modified / sha256 / 输出路径 / 行数)"""
+    try:
+        with open(FETCH_CACHE_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_fetch_cache(cache):
+    FETCH_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = FETCH_CACHE_FILE.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write('\n')
+    os.replace(tmp_path, FETCH_CACHE_FILE)
+
+def is_reusable(entry, abs_path):
+    """缓存条目对应的输出文件仍然存在、路径未变，且由当前版本的清洗代码生成"""
+    return (bool(entry) and entry.get('path') == abs_path.as_posix()
+            and entry.get('processor') == PROCESSOR_VERSION and abs_path.exists())
+
+def conditional_headers(entry, abs_path):
+    """仅当上次输出仍然存在时才发送条件请求头"""
+    if not is_reusable(entry, abs_path):
+        return {}
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+def download_content(url, session=None, headers=None):
+    """下载内容，带重试机制；返回 Response (200 或 304)，失败返回 None"""
+    getter = session.get if session is not None else requests.get
     for attempt in range(RETRIES + 1):
         try:
-            resp = requests.get(url, timeout=TIMEOUT)
+            with instrument.span("download", key=url):
+                resp = getter(url, timeout=TIMEOUT, headers=headers)
+            if resp.status_code == 304:
+                return resp
             resp.raise_for_status()
-            return resp.content
+            return resp
         except requests.RequestException:
             if attempt == RETRIES:
                 return None
     return None
 
+def cached_line_count(entry, abs_path):
+    """优先使用缓存中记录的行数，避免重新读取文件"""
+    if isinstance(entry.get('lines'), int):
+        return entry['lines']
+    with open(abs_path, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
 def parse_sources():
     """解析 sources.urls 文件"""
     tasks = []
@@ -116,6 +192,7 @@ def clean_orphans(expected_files):
     for f in actual_files:
         if f not in expected_set:
             logger.info(f"Deleting orphan: {f}")
+            delta.record("sync", Path(f).as_posix(), f, [])
             os.remove(f)
     
     for dirpath, _, _ in os.walk(RULESETS_DIR, topdown=False):
@@ -131,10 +208,10 @@ def generate_summary():
 
     with open(summary_path, 'a', encoding='utf-8') as f:
         f.write("# 🛡️ Rules Sync Dashboard (Python Engine)\n\n")
-        f.write(f"| 🟢 Success | 🔴 Failures | 📉 Total Rules |\n")
-        f.write(f"| :---: | :---: | :---: |\n")
+        f.write(f"| 🟢 Success | 💤 Not Modified | ♻️ Unchanged | 🔴 Failures | 📉 Total Rules |\n")
+        f.write(f"| :---: | :---: | :---: | :---: | :---: |\n")
         total_fail = len(stats.download_errors) + len(stats.parse_errors)
-        f.write(f"| **{stats.success}** | **{total_fail}** | **{stats.total_lines}** |\n\n")
+        f.write(f"| **{stats.success}** | **{stats.not_modified}** | **{stats.unchanged}** | **{total_fail}** | **{stats.total_lines}** |\n\n")
 
         if total_fail > 0:
             f.write("## 🚨 Error Diagnostics\n\n| Type | Failed Source URL |\n| :--- | :--- |\n")
@@ -169,48 +246,125 @@ def git_push():
     
     logger.info("::endgroup::")
 
-def main():
-    logger.info("::group::🔧 Initialization")
-    tasks = parse_sources()
-    logger.info(f"Loaded {len(tasks)} sources.")
-    logger.info("::endgroup::")
+def resolve_targets(tasks):
+    """为每个源计算所有者、文件名与输出路径"""
+    for task in tasks:
+        url = task['url']
+        task['owner'] = get_owner(url)
+        task['filename'] = url.split('/')[-1].split('.')[0] + ".txt"
+        task['abs_path'] = RULESETS_DIR / task['policy'] / task['type'] / task['owner'] / task['filename']
+    return tasks
 
+def ruleset_bytes(result):
+    """清洗结果 -> 文件内容 (DomainSet 直接使用其内部的字节串)"""
+    return result.to_bytes() if isinstance(result, DomainSet) else '\n'.join(result).encode('utf-8')
+
+def write_ruleset(abs_path, result):
+    abs_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(abs_path, 'wb') as f:
+        f.write(ruleset_bytes(result))
+
+def sync_sources(tasks, fetch_cache, save=write_ruleset):
+    """
+    下载并清洗全部源，返回期望存在的文件列表
+    save(abs_path, result) 负责保存新结果 (流水线模式下写入内存，最后统一落盘)
+    """
     expected_files = []
 
-    for task in tasks:
+    # 并发下载，按原顺序依次处理，保证日志分组与统计顺序稳定
+    session = create_session()
+    executor = ThreadPoolExecutor(max_workers=max(MAX_WORKERS, 1))
+    futures = [
+        executor.submit(download_content, t['url'], session,
+                        conditional_headers(fetch_cache.get(t['url']), t['abs_path']))
+        for t in tasks
+    ]
+
+    for task, future in zip(tasks, futures):
         url = task['url']
-        owner = get_owner(url)
-        filename = url.split('/')[-1].split('.')[0] + ".txt"
-        
-        rel_path = Path(task['policy']) / task['type'] / owner / filename
-        abs_path = RULESETS_DIR / rel_path
+        owner = task['owner']
+        filename = task['filename']
+        abs_path = task['abs_path']
         expected_files.append(abs_path)
         
         logger.info(f"::group::⚙️ [{task['policy']}/{task['type']}] {owner}/{filename}")
         
-        raw_bytes = download_content(url)
-        if raw_bytes is None:
+        with instrument.span("wait_download"):
+            resp = future.result()
+        if resp is None:
             logger.error(f"::error::Download failed: {url}")
             stats.download_errors.append(url)
             logger.info("::endgroup::")
             continue
 
+        entry = fetch_cache.get(url)
+        if resp.status_code == 304 and not is_reusable(entry, abs_path):
+            # 条件请求头只在缓存可用时发送；若缓存已失效 (如清洗代码版本变化) 仍收到 304，则重新完整下载
+            with instrument.span("wait_download"):
+                resp = download_content(url, session)
+            if resp is None or resp.status_code == 304:
+                logger.error(f"::error::Download failed: {url}")
+                stats.download_errors.append(url)
+                logger.info("::endgroup::")
+                continue
+
+        if resp.status_code == 304:
+            count = cached_line_count(entry, abs_path)
+            entry['lines'] = count
+            stats.success += 1
+            stats.not_modified += 1
+            stats.total_lines += count
+            logger.info(f"NOT MODIFIED: Reused {count} lines.")
+            logger.info("::endgroup::")
+            continue
+
+        raw_bytes = resp.content
+        instrument.count("bytes_downloaded", len(raw_bytes))
+        with instrument.span("hash"):
+            raw_hash = hashlib.sha256(raw_bytes).hexdigest()
+        if is_reusable(entry, abs_path) and entry.get('sha256') == raw_hash:
+            # 镜像未返回可靠的校验头时，按原始字节哈希判断是否需要重新解析
+            count = cached_line_count(entry, abs_path)
+            entry.update({
+                'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified'),
+                'lines': count,
+            })
+            stats.success += 1
+            stats.unchanged += 1
+            stats.total_lines += count
+            logger.info(f"UNCHANGED: Reused {count} lines (sha256 match).")
+            logger.info("::endgroup::")
+            continue
+
         try:
-            content_str = processor.safe_decode(raw_bytes)
-            lines = processor.parse_lines(content_str)
+            lines = instrument.timed_iter(
+                "parse", processor.parse_stream(processor.iter_chunks(io.BytesIO(raw_bytes))), key=filename)
             
-            if task['type'] == 'ipcidr':
-                result = processor.process_ip(lines)
-            else:
-                result = processor.process_domain(lines)
+            with instrument.span("clean", key=filename):
+                if task['type'] == 'ipcidr':
+                    result = processor.process_ip(lines)
+                else:
+                    result = processor.process_domain(lines)
+            instrument.count("rules_out", len(result))
             
-            abs_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(abs_path, 'w', encoding='utf-8') as f:
-                f.write('\n'.join(result))
+            with instrument.span("diff", key=filename):
+                delta.record("sync", abs_path.as_posix(), abs_path, result,
+                             delta.cidr_key if task['type'] == 'ipcidr' else None)
+            with instrument.span("write", key=filename):
+                save(abs_path, result)
             
             count = len(result)
             stats.success += 1
             stats.total_lines += count
+            fetch_cache[url] = {
+                'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified'),
+                'sha256': raw_hash,
+                'path': abs_path.as_posix(),
+                'processor': PROCESSOR_VERSION,
+                'lines': count,
+            }
             logger.info(f"SUCCESS: Saved {count} lines.")
             
         except Exception as e:
@@ -219,9 +373,27 @@ def main():
         
         logger.info("::endgroup::")
 
+    executor.shutdown(wait=True)
+    session.close()
+    return expected_files
+
+def main():
+    logger.info("::group::🔧 Initialization")
+    tasks = resolve_targets(parse_sources())
+    logger.info(f"Loaded {len(tasks)} sources.")
+    logger.info("::endgroup::")
+
+    fetch_cache = load_fetch_cache()
+    expected_files = sync_sources(tasks, fetch_cache)
+
+    live_urls = set(t['url'] for t in tasks)
+    save_fetch_cache({u: e for u, e in fetch_cache.items() if u in live_urls})
+
     clean_orphans(expected_files)
     
     generate_summary()
+    delta.report("sync")
+    instrument.report("sync")
     
     strict_mode = os.getenv('STRICT_MODE', 'false').lower() == 'true'
     fail_count = len(stats.download_errors) + len(stats.parse_errors)
@@ -229,7 +401,8 @@ def main():
     if fail_count > 0 and strict_mode:
         sys.exit(1)
 
-    git_push()
+    if os.getenv('GIT_PUSH', 'true').lower() == 'true':
+        git_push()
 
 if __name__ == "__main__":
     main()
@@ -1,21 +1,46 @@
 import os
+import re
 import sys
+import mmap
+import heapq
 import yaml
-import ipaddress
 import time
+import hashlib
+import operator
+from itertools import islice
 import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from contextlib import contextmanager
+from collections import OrderedDict
 from rich.console import Console
 from rich.table import Table
 from rich.panel import Panel
 from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TaskProgressColumn
 from rich.traceback import install
+from cidr import RangeSet, parse_cidr, iter_collapsed
+import instrument
+from domainset import DomainSet
+import delta
 
 install(show_locals=True)
 console = Console()
 CONFIG_FILE = "merge-config.yaml"
 SOURCE_DIR = "rulesets"
 OUTPUT_DIR = "merged-rules"
+# 流式 k 路归并：auto = 输入均已排序时使用 (DOMAIN 不剪枝 / IP-CIDR)，off = 始终使用集合合并
+STREAM_MERGE = os.getenv('MERGE_STREAMING', 'auto').lower() != 'off'
+STREAM_CHUNK = 1024 * 1024
+# 输出先写入暂存目录，正文 (忽略 # Date 行) 有变化的文件才替换到 OUTPUT_DIR
+STAGING_DIR = os.path.join(".cache", "merge-staging")
+VOLATILE_PREFIX = b"# Date:"
+# 头部计数的定宽 (补零)：流式写出与整体写出的头部长度与字节完全一致
+COUNT_WIDTH = 10
+# 已解析输入的缓存上限 (按 DomainSet 实际占用计算)
+CACHE_BUDGET = int(os.getenv('MERGE_CACHE_MB', '256')) * 1024 * 1024
+# 合并任务的进程数，1 = 在主进程中串行执行
+MERGE_WORKERS = int(os.getenv('MERGE_WORKERS', str(os.cpu_count() or 1)))
 
 STATS = {
     "success": 0,
@@ -27,6 +52,48 @@ ERROR_LOGS = []
 SUMMARY_ROWS = []
 
 USED_SOURCE_FILES = set()
+PUBLISH_STATS = {}
+
+class InputCache:
+    """
+    已解析输入的 LRU 缓存：键为源文件路径，并校验 (mtime, size)，按内存占用淘汰最久未用的条目
+    缓存的规则集合由多个任务共享，调用方只读不改
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.used = 0
+
+    def get(self, path, stamp):
+        entry = self.entries.get(path)
+        if entry is None or entry[0] != stamp:
+            return None
+        self.entries.move_to_end(path)
+        return entry[1]
+
+    def put(self, path, stamp, rules, size):
+        old = self.entries.pop(path, None)
+        if old is not None:
+            self.used -= old[2]
+        if size > self.budget:
+            return
+        self.entries[path] = (stamp, rules, size)
+        self.used += size
+        while self.used > self.budget:
+            _, (_, _, evicted) = self.entries.popitem(last=False)
+            self.used -= evicted
+            instrument.count("input_cache_evictions")
+
+    def preload(self, entries):
+        for path, (stamp, rules, size) in entries.items():
+            self.put(path, stamp, rules, size)
+
+    def clear(self):
+        self.entries.clear()
+        self.used = 0
+
+INPUT_CACHE = InputCache(CACHE_BUDGET)
 
 def normalize_path(p):
     """标准化路径分隔符"""
@@ -39,74 +106,343 @@ def detect_mode(type_str, filename):
     return 'DOMAIN'
 
 def flatten_ip_cidr(cidr_set):
-    """IPv4/IPv6 分离聚合算法"""
-    ipv4_nets = []
-    ipv6_nets = []
+    """IPv4/IPv6 分离聚合算法 (整数区间排序合并)"""
+    ranges = RangeSet()
     for c in cidr_set:
         c = c.strip()
         if not c: continue
         try:
-            net = ipaddress.ip_network(c, strict=False)
-            if net.version == 4: ipv4_nets.append(net)
-            else: ipv6_nets.append(net)
+            version, start, end, _ = parse_cidr(c)
         except ValueError as e:
             raise ValueError(f"Invalid CIDR '{c}': {e}")
-    
-    v4_res = [str(n) for n in ipaddress.collapse_addresses(ipv4_nets)]
-    v6_res = [str(n) for n in ipaddress.collapse_addresses(ipv6_nets)]
-    return v4_res + v6_res
+        ranges.add(version, start, end)
+    return ranges.to_cidrs()
 
-def process_task_logic(strategy, rule_type, owner, filename, inputs, desc):
-    """通用的任务处理核心逻辑"""
-    
-    relative_dir = os.path.join(strategy, rule_type, owner)
-    full_output_dir = os.path.join(OUTPUT_DIR, relative_dir)
-    full_output_file = os.path.join(full_output_dir, filename)
-    combined_rules = set()
+def prune_covered_domains(domains):
+    """
+    后缀去重：父域名已覆盖的子域名直接剔除 (反转域名排序后单次扫描)，返回 DomainSet
+    全程在 DomainSet 的字节串上进行：把 '.' + 条目 整体反转即得到各条的 "反转域名 + '.'" 键；
+    扫描只收集被覆盖的少数键，释放全部键之后再从原集合中过滤，不生成 str 对象
+    """
+    if not isinstance(domains, DomainSet):
+        domains = DomainSet.from_iterable(domains)
+    if not domains:
+        return domains
+    keys = (b'.' + domains.to_bytes().replace(b'\n', b'\n.'))[::-1].split(b'\n')
+    keys.sort()
+    covered = []
+    parent = None
+    for key in keys:
+        if parent is not None and key.startswith(parent):
+            covered.append(key)
+            continue
+        parent = key
+    del keys
+    if not covered:
+        return domains
+    drop = set(b'\n'.join(covered)[::-1][1:].replace(b'\n.', b'\n').split(b'\n'))
+    del covered
+    return DomainSet.from_unique_list([d for d in domains.iter_bytes() if d not in drop])
+
+def clean_rule_lines(lines):
+    """去注释、去空行"""
+    rules = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#') or line.startswith('//'): continue
+        if '#' in line: line = line.split('#')[0].strip()
+        rules.append(line)
+    return rules
+
+# 与 clean_rule_lines 等价的字节级规则匹配 (仅用于纯 ASCII 内容)：
+# 去首尾空白，跳过空行 / # 注释 / // 注释，行内 # 之后的内容连同前面的空白一并去掉
+RULE_LINE = re.compile(rb'^[ \t\f\v]*(?!//)([^\s#](?:[^#\n]*[^\s#])?)[ \t\f\v]*(?:#[^\n]*)?$', re.M)
+# 需要清洗的行：以 // 开头，或含有 # / 空白
+DIRTY_LINE = re.compile(rb'^(?://|[^\n]*[# \t\f\v])[^\n]*$', re.M)
+DIRTY_MARKS = (b'#', b'//', b' ', b'\t', b'\x0b', b'\x0c')
+# str.strip() 也会去掉的 ASCII 控制字符 (\x1c-\x1f)，出现时回退到逐行路径
+STR_ONLY_SPACE = re.compile(rb'[\x1c-\x1f]')
+
+@contextmanager
+def map_file(path):
+    """mmap 只读映射整个文件 (空文件直接给出空字节串)，退出时解除映射"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+def iter_line_chunks(buf, size=STREAM_CHUNK):
+    """
+    把 buf (bytes / mmap) 按行边界切成不超过约 size 字节的片段 (不含分界处的 \n)
+    每次只复制一个片段，不会生成整个文件的副本；不足 size 的 bytes 原样返回
+    """
+    n = len(buf)
+    pos = 0
+    while pos < n:
+        end = n
+        if pos + size < n:
+            end = buf.rfind(b'\n', pos, pos + size)
+            if end < 0:
+                end = buf.find(b'\n', pos + size)
+                if end < 0:
+                    end = n
+        yield buf[pos:end]
+        pos = end + 1
+
+def bulk_rules(buf):
+    """
+    在字节层面批量过滤注释与空行并去重，返回有序的 DomainSet
+    buf 可以是 bytes 或 mmap：逐片段检查与切分，干净的行直接由 bytes.split 得到，
+    只有含注释 / 空白的少数行再做清洗
+    """
+    if buf.find(b'\r') >= 0:
+        buf = buf[:].replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+    lines = []
+    dirty = set()
+    for chunk in iter_line_chunks(buf):
+        if not chunk.isascii() or STR_ONLY_SPACE.search(chunk):
+            del lines
+            text = buf[:].decode('utf-8')
+            return DomainSet.from_iterable(clean_rule_lines(text.split('\n')))
+        if any(mark in chunk for mark in DIRTY_MARKS):
+            dirty.update(DIRTY_LINE.findall(chunk))
+        lines.extend(chunk.split(b'\n'))
+
+    if not dirty:
+        # processor 的输出本身已排序且无重复：严格递增时直接使用，省去集合与排序
+        if lines and not lines[-1]:
+            lines.pop()
+        if lines and lines[0] and all(map(operator.lt, lines, islice(lines, 1, None))):
+            return DomainSet.from_unique_list(lines)
+    rules = set(lines)
+    del lines
+    if dirty:
+        rules -= dirty
+        rules.update(RULE_LINE.findall(b'\n'.join(dirty)))
+    rules.discard(b'')
+    return DomainSet.from_unique_list(sorted(rules))
+
+def read_source_rules(rel_input):
+    """
+    从 rulesets 目录读取单个源文件，返回去重后的规则 (DomainSet)
+    同一文件在一次运行中只解析一次 (文件有变化时按 mtime / size 失效)
+    """
+    full_src_path = os.path.join(SOURCE_DIR, rel_input)
+    try:
+        st = os.stat(full_src_path)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Source file not found: {rel_input}")
+    key = normalize_path(full_src_path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    rules = INPUT_CACHE.get(key, stamp)
+    if rules is not None:
+        instrument.count("input_cache_hits")
+        return rules
+    instrument.count("input_cache_misses")
+    with map_file(full_src_path) as buf:
+        rules = bulk_rules(buf)
+    INPUT_CACHE.put(key, stamp, rules, rules.nbytes)
+    return rules
+
+def merge_task_rules(rule_type, filename, inputs, prune=True, reader=read_source_rules):
+    """
+    合并一个任务的全部输入并优化
+    reader 返回 DomainSet 或 UTF-8 字节串序列，全部输入以 k 路归并合成一个 DomainSet，
+    之后按需逐块解码
+    返回 (mode, final_list, raw_count, pruned_count, files_read_count)，无输入可读时返回 None
+    """
+    parts = []
     files_read_count = 0
 
     for rel_input in inputs:
-        full_src_path = os.path.join(SOURCE_DIR, rel_input)
-        rel_src_norm = normalize_path(rel_input)
-        USED_SOURCE_FILES.add(rel_src_norm)
-
-        if not os.path.exists(full_src_path):
-            raise FileNotFoundError(f"Source file not found: {rel_input}")
-        
-        with open(full_src_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith('#') or line.startswith('//'): continue
-                if '#' in line: line = line.split('#')[0].strip()
-                combined_rules.add(line)
-            files_read_count += 1
+        USED_SOURCE_FILES.add(normalize_path(rel_input))
+        with instrument.span("read", key=rel_input):
+            parts.append(reader(rel_input))
+        files_read_count += 1
 
     if files_read_count == 0 and inputs:
         return None
 
+    with instrument.span("union"):
+        combined_rules = DomainSet.union_of(parts)
+    del parts
+
     mode = detect_mode(rule_type, filename)
     raw_count = len(combined_rules)
-    
+
+    pruned_count = 0
+    with instrument.span("optimize"):
+        if mode == 'IP-CIDR':
+            final_list = flatten_ip_cidr(combined_rules)
+        elif prune:
+            final_list = prune_covered_domains(combined_rules)
+            pruned_count = raw_count - len(final_list)
+        else:
+            final_list = combined_rules
+    instrument.count("rules_in", raw_count)
+
+    return mode, final_list, raw_count, pruned_count, files_read_count
+
+def render_header(strategy, rule_type, owner, mode, count, raw_count, pruned_count, desc):
+    """合并输出文件的头部注释"""
+    header = [
+        "# ----------------------------------------",
+        f"# Strategy: {strategy}",
+        f"# Type:     {rule_type}",
+        f"# Owner:    {owner}",
+        f"# Date:     {time.strftime('%Y-%m-%d %H:%M:%S')}",
+        f"# Mode:     {mode}",
+        f"# Count:    {count:0{COUNT_WIDTH}d} (Raw: {raw_count:0{COUNT_WIDTH}d}, Pruned: {pruned_count:0{COUNT_WIDTH}d})",
+        f"# Desc:     {desc}",
+        "# ----------------------------------------",
+    ]
+    return "\n".join(header) + "\n"
+
+def render_output(strategy, rule_type, owner, mode, final_list, raw_count, pruned_count, desc):
+    """生成合并输出文件的完整文本 (头部注释 + 规则)"""
+    header = render_header(strategy, rule_type, owner, mode, len(final_list), raw_count, pruned_count, desc)
+    body = final_list.to_bytes().decode('utf-8') if isinstance(final_list, DomainSet) else "\n".join(final_list)
+    return header + body + "\n"
+
+class UnsortedInput(Exception):
+    """流式合并的输入未排序 (或含需要清洗的行)，需回退到集合合并"""
+
+def iter_sorted_rules(rel_input, key=None):
+    """
+    逐行读取已清洗且有序的源文件 (processor 的输出)，不满足条件时抛出 UnsortedInput
+    key 不为空时产出 (key(rule), rule)，并按 key 检查顺序
+    """
+    full_src_path = os.path.join(SOURCE_DIR, rel_input)
+    prev = None
+    with open(full_src_path, 'r', encoding='utf-8', newline='') as f:
+        for line in f:
+            rule = line.rstrip('\n')
+            if not rule: continue
+            if rule != rule.strip() or rule.startswith('//') or '#' in rule:
+                raise UnsortedInput(f"{rel_input}: needs cleaning")
+            item = rule if key is None else (key(rule), rule)
+            if prev is not None and item < prev:
+                raise UnsortedInput(f"{rel_input}: not sorted")
+            prev = item
+            yield item
+
+def cidr_key(rule):
+    try:
+        version, start, end, _ = parse_cidr(rule)
+    except ValueError as e:
+        raise ValueError(f"Invalid CIDR '{rule}': {e}")
+    return version, start, end
+
+def stream_task_rules(mode, inputs, counter):
+    """
+    k 路归并有序输入并即时去重，逐条产出最终规则；同时只在内存中保留每个输入的一行
+    DOMAIN (不剪枝) 按字符串序归并；IP-CIDR 按 (地址族, 起点) 归并后逐段合并为最小 CIDR
+    counter["raw"] 记录去重后的原始规则数
+    """
     if mode == 'IP-CIDR':
-        final_list = flatten_ip_cidr(combined_rules)
+        merged = heapq.merge(*(iter_sorted_rules(i, cidr_key) for i in inputs))
+        def ranges():
+            prev = None
+            for item in merged:
+                if item == prev: continue
+                prev = item
+                counter["raw"] += 1
+                yield item[0]
+        yield from iter_collapsed(ranges())
     else:
-        final_list = sorted(list(combined_rules))
-    
-    opt_count = len(final_list)
-
-    os.makedirs(full_output_dir, exist_ok=True)
-    with open(full_output_file, 'w', encoding='utf-8') as f:
-        f.write(f"# ----------------------------------------\n")
-        f.write(f"# Strategy: {strategy}\n")
-        f.write(f"# Type:     {rule_type}\n")
-        f.write(f"# Owner:    {owner}\n")
-        f.write(f"# Date:     {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"# Mode:     {mode}\n")
-        f.write(f"# Count:    {opt_count} (Raw: {raw_count})\n")
-        f.write(f"# Desc:     {desc}\n")
-        f.write(f"# ----------------------------------------\n")
-        f.write("\n".join(final_list))
-        f.write("\n")
+        prev = None
+        for rule in heapq.merge(*(iter_sorted_rules(i) for i in inputs)):
+            if rule == prev: continue
+            prev = rule
+            counter["raw"] += 1
+            yield rule
+
+def stream_task(strategy, rule_type, owner, filename, inputs, desc, full_output_file):
+    """
+    流式合并并直接写入暂存路径：头部计数为定宽字段，长度事先可知，
+    先预留头部空间，正文写完后回到文件开头写入实际头部，不再经过临时文件
+    返回 (mode, opt_count, raw_count)；输入无序时抛出 UnsortedInput (不会留下输出文件)
+    """
+    mode = detect_mode(rule_type, filename)
+    for rel_input in inputs:
+        USED_SOURCE_FILES.add(normalize_path(rel_input))
+        if not os.path.exists(os.path.join(SOURCE_DIR, rel_input)):
+            raise FileNotFoundError(f"Source file not found: {rel_input}")
+
+    reserved = len(render_header(strategy, rule_type, owner, mode, 0, 0, 0, desc).encode('utf-8'))
+    os.makedirs(os.path.dirname(full_output_file), exist_ok=True)
+    counter = {"raw": 0}
+    opt_count = 0
+    try:
+        with open(full_output_file, 'w', encoding='utf-8') as out:
+            out.write(" " * reserved)
+            for rule in stream_task_rules(mode, inputs, counter):
+                out.write(rule)
+                out.write("\n")
+                opt_count += 1
+            if opt_count == 0:
+                out.write("\n")
+            header = render_header(strategy, rule_type, owner, mode, opt_count, counter["raw"], 0, desc)
+            if len(header.encode('utf-8')) != reserved:
+                raise ValueError(f"rule count exceeds {COUNT_WIDTH} digits")
+            out.seek(0)
+            out.write(header)
+    except BaseException:
+        if os.path.exists(full_output_file):
+            os.remove(full_output_file)
+        raise
+    return mode, opt_count, counter["raw"]
+
+def can_stream(rule_type, filename, prune):
+    """剪枝需要按反转域名排序，无法在字符串序的归并中完成，因此只有不剪枝的 DOMAIN 与 IP-CIDR 走流式路径"""
+    return STREAM_MERGE and (not prune or detect_mode(rule_type, filename) == 'IP-CIDR')
+
+def process_task_logic(strategy, rule_type, owner, filename, inputs, desc, prune=True,
+                       reader=read_source_rules, writer=None):
+    """
+    通用的任务处理核心逻辑
+    reader / writer 可替换：流水线模式下从内存读取输入、把输出写入内存
+    """
+    with instrument.span("task", key=f"{strategy}/{rule_type}/{owner}/{filename}"):
+        rel_output = os.path.join(strategy, rule_type, owner, filename)
+        if writer is None and reader is read_source_rules and can_stream(rule_type, filename, prune):
+            full_output_file = os.path.join(STAGING_DIR, rel_output)
+            try:
+                with instrument.span("stream"):
+                    mode, opt_count, raw_count = stream_task(strategy, rule_type, owner, filename,
+                                                             inputs, desc, full_output_file)
+                instrument.count("streamed_tasks")
+                instrument.count("rules_in", raw_count)
+                return {
+                    "file": filename,
+                    "path": f"{strategy}/{rule_type}/{owner}",
+                    "mode": mode,
+                    "src_count": len(inputs),
+                    "raw": raw_count,
+                    "pruned": 0,
+                    "opt": opt_count
+                }
+            except UnsortedInput as e:
+                instrument.count("stream_fallbacks")
+                console.print(f"[dim]↩️ {filename}: streaming skipped ({e})[/dim]")
+
+        merged = merge_task_rules(rule_type, filename, inputs, prune, reader)
+        if merged is None:
+            return None
+        mode, final_list, raw_count, pruned_count, files_read_count = merged
+
+        with instrument.span("write"):
+            content = render_output(strategy, rule_type, owner, mode, final_list, raw_count, pruned_count, desc)
+            if writer is not None:
+                writer(rel_output, content, final_list)
+            else:
+                full_output_file = os.path.join(STAGING_DIR, rel_output)
+                os.makedirs(os.path.dirname(full_output_file), exist_ok=True)
+                with open(full_output_file, 'w', encoding='utf-8') as f:
+                    f.write(content)
 
     return {
         "file": filename,
@@ -114,149 +450,289 @@ def process_task_logic(strategy, rule_type, owner, filename, inputs, desc):
         "mode": mode,
         "src_count": files_read_count,
         "raw": raw_count,
-        "opt": opt_count
+        "pruned": pruned_count,
+        "opt": len(final_list)
     }
 
-def auto_discover_files():
-    """扫描 rulesets 文件夹，发现未使用的文件"""
-    discovered_tasks = []
+def list_source_files():
+    """扫描 rulesets 文件夹，返回全部规则文件的相对路径"""
+    rel_paths = []
     if not os.path.exists(SOURCE_DIR):
-        return []
-
+        return rel_paths
     for root, dirs, files in os.walk(SOURCE_DIR):
         for file in files:
             if file.startswith('.') or not file.endswith('.txt'):
                 continue
+            rel_paths.append(os.path.relpath(os.path.join(root, file), SOURCE_DIR))
+    return rel_paths
 
-            abs_path = os.path.join(root, file)
-            rel_path = os.path.relpath(abs_path, SOURCE_DIR)
-            rel_path_norm = normalize_path(rel_path)
-            if rel_path_norm in USED_SOURCE_FILES:
-                continue
+def auto_discover_files(source_files=None):
+    """发现未被配置任务使用的源文件 (source_files 为空时扫描 rulesets 文件夹)"""
+    discovered_tasks = []
+    if source_files is None:
+        source_files = list_source_files()
 
-            parts = Path(rel_path_norm).parent.parts
-            d_strat = parts[0] if len(parts) >= 1 else "Auto"
-            d_type = parts[1] if len(parts) >= 2 else "General"
-            d_owner = parts[2] if len(parts) >= 3 else "Unknown"
-
-            discovered_tasks.append({
-                "strategy": d_strat,
-                "type": d_type,
-                "owner": d_owner,
-                "filename": file,
-                "inputs": [rel_path_norm],
-                "description": f"Auto-detected from {rel_path_norm}"
-            })
-            
-    return discovered_tasks
+    for rel_path in source_files:
+        rel_path_norm = normalize_path(rel_path)
+        file = os.path.basename(rel_path_norm)
+        if rel_path_norm in USED_SOURCE_FILES:
+            continue
 
+        parts = Path(rel_path_norm).parent.parts
+        d_strat = parts[0] if len(parts) >= 1 else "Auto"
+        d_type = parts[1] if len(parts) >= 2 else "General"
+        d_owner = parts[2] if len(parts) >= 3 else "Unknown"
+
+        discovered_tasks.append({
+            "strategy": d_strat,
+            "type": d_type,
+            "owner": d_owner,
+            "filename": file,
+            "inputs": [rel_path_norm],
+            "description": f"Auto-detected from {rel_path_norm}"
+        })
+        
+    return discovered_tasks
 
-def main():
-    console.rule("[bold blue]🚀 Hybrid Merger (Smart Clean)[/bold blue]")
 
+def load_config_tasks():
+    """读取 merge-config.yaml 中的 merges 任务列表"""
     if not os.path.exists(CONFIG_FILE):
-        console.print(f"[yellow]⚠️ Warning: Config '{CONFIG_FILE}' not found. Will use Auto-Mode only.[/yellow]")
-    
-    if not os.path.exists(SOURCE_DIR):
-        console.print(f"[bold red]❌ CRITICAL: Directory '{SOURCE_DIR}' not found![/bold red]")
+        return []
+    try:
+        with open(CONFIG_FILE, 'r') as f:
+            data = yaml.safe_load(f) or {}
+            return data.get('merges', [])
+    except Exception as e:
+        console.print(f"[red]Config Error:[/red] {e}")
         sys.exit(1)
 
-    if os.path.exists(OUTPUT_DIR):
-        console.print("[dim]🧹 Cleaning output directory...[/dim]")
-        for item in os.listdir(OUTPUT_DIR):
-            item_path = os.path.join(OUTPUT_DIR, item)
-            try:
-                if os.path.isfile(item_path) or os.path.islink(item_path):
-                    os.unlink(item_path)
-                elif os.path.isdir(item_path):
-                    shutil.rmtree(item_path)
-            except Exception as e:
-                console.print(f"[yellow]Warning: Failed to delete {item_path}: {e}[/yellow]")
-    else:
-        os.makedirs(OUTPUT_DIR)
+def config_task_kwargs(t):
+    """配置任务 -> process_task_logic 的参数"""
+    if 'inputs' not in t: raise ValueError("Missing inputs")
+    return dict(
+        strategy=t.get('strategy', 'Default'), rule_type=t.get('type', 'General'),
+        owner=t.get('owner', 'Unknown'), filename=t.get('filename', 'Unknown'), inputs=t['inputs'],
+        desc=t.get('description', 'Configured Merge'), prune=t.get('prune_subdomains', True)
+    )
 
-    config_tasks = []
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r') as f:
-                data = yaml.safe_load(f) or {}
-                config_tasks = data.get('merges', [])
-        except Exception as e:
-            console.print(f"[red]Config Error:[/red] {e}")
-            sys.exit(1)
-    with Progress(
-        SpinnerColumn(),
-        TextColumn("[bold blue]{task.description}"),
-        BarColumn(),
-        TaskProgressColumn(),
-        console=console
-    ) as progress:
-
-        if config_tasks:
-            task_main = progress.add_task("[cyan]Running Config Tasks[/cyan]", total=len(config_tasks))
-            for t in config_tasks:
-                try:
-                    fname = t.get('filename', 'Unknown')
-                    progress.update(task_main, description=f"Config Task: {fname}")
-                    
-                    if 'inputs' not in t: raise ValueError("Missing inputs")
-                    
-                    res = process_task_logic(
-                        t.get('strategy', 'Default'), t.get('type', 'General'),
-                        t.get('owner', 'Unknown'), fname, t['inputs'],
-                        t.get('description', 'Configured Merge')
-                    )
-                    if res:
-                        STATS['success'] += 1
-                        STATS['total_rules'] += res['opt']
-                        SUMMARY_ROWS.append(res)
-                    else:
-                        STATS['skipped'] += 1
-                except Exception as e:
-                    STATS['failed'] += 1
-                    ERROR_LOGS.append(f"Config Task '{fname}': {str(e)}")
-                progress.advance(task_main)
-
-        auto_tasks = auto_discover_files()
-        if auto_tasks:
-            task_auto = progress.add_task("[magenta]Running Auto-Discovery[/magenta]", total=len(auto_tasks))
-            for t in auto_tasks:
-                try:
-                    progress.update(task_auto, description=f"Auto: {t['filename']}")
-                    res = process_task_logic(
-                        t['strategy'], t['type'], t['owner'], 
-                        t['filename'], t['inputs'], t['description']
-                    )
-                    if res:
-                        STATS['success'] += 1
-                        STATS['total_rules'] += res['opt']
-                        res['file'] = f"(Auto) {res['file']}"
-                        SUMMARY_ROWS.append(res)
-                except Exception as e:
-                    STATS['failed'] += 1
-                    ERROR_LOGS.append(f"Auto Task '{t['filename']}': {str(e)}")
-                progress.advance(task_auto)
+def auto_task_kwargs(t):
+    """自动发现任务 -> process_task_logic 的参数；不剪枝，输出与单个源文件的内容一致"""
+    return dict(
+        strategy=t['strategy'], rule_type=t['type'], owner=t['owner'],
+        filename=t['filename'], inputs=t['inputs'], desc=t['description'],
+        prune=False
+    )
+
+def execute_task(kind, t, reader=read_source_rules, writer=None):
+    """执行单个任务，返回 (结果, 错误信息)"""
+    try:
+        kwargs = config_task_kwargs(t) if kind == 'config' else auto_task_kwargs(t)
+        return process_task_logic(**kwargs, reader=reader, writer=writer), None
+    except Exception as e:
+        return None, str(e)
+
+def collect_result(kind, t, res, err):
+    """按任务顺序汇总结果，保证 STATS / SUMMARY_ROWS 与串行执行一致"""
+    if err is not None:
+        STATS['failed'] += 1
+        label = f"Config Task '{t.get('filename', 'Unknown')}'" if kind == 'config' else f"Auto Task '{t['filename']}'"
+        ERROR_LOGS.append(f"{label}: {err}")
+    elif res:
+        STATS['success'] += 1
+        STATS['total_rules'] += res['opt']
+        if kind == 'auto':
+            res['file'] = f"(Auto) {res['file']}"
+        SUMMARY_ROWS.append(res)
+    elif kind == 'config':
+        STATS['skipped'] += 1
+
+def shared_inputs(config_tasks):
+    """被多个配置任务引用的输入文件：由主进程解析一次放入缓存，再交给各工作进程"""
+    refs = {}
+    for t in config_tasks:
+        for rel_input in t.get('inputs') or []:
+            key = normalize_path(rel_input)
+            refs[key] = refs.get(key, 0) + 1
+    for key, n in refs.items():
+        if n > 1 and os.path.isfile(os.path.join(SOURCE_DIR, key)):
+            with instrument.span("read_shared", key=key):
+                read_source_rules(key)
+    return dict(INPUT_CACHE.entries)
+
+def _init_worker(shared, dirs):
+    global SOURCE_DIR, OUTPUT_DIR, STAGING_DIR
+    SOURCE_DIR, OUTPUT_DIR, STAGING_DIR = dirs
+    INPUT_CACHE.preload(shared)
+
+def _pool_task(kind, t):
+    """工作进程中执行任务，返回 (结果, 错误信息, 用到的输入, 本任务的度量)"""
+    USED_SOURCE_FILES.clear()
+    res, err = execute_task(kind, t)
+    return res, err, sorted(USED_SOURCE_FILES), instrument.export_state()
+
+def run_phase(progress, bar, kind, tasks, reader, writer, pool):
+    def label(t):
+        name = t.get('filename', 'Unknown')
+        return f"Config Task: {name}" if kind == 'config' else f"Auto: {name}"
+
+    if pool is None:
+        for t in tasks:
+            progress.update(bar, description=label(t))
+            collect_result(kind, t, *execute_task(kind, t, reader, writer))
+            progress.advance(bar)
+        return
+
+    futures = {pool.submit(_pool_task, kind, t): i for i, t in enumerate(tasks)}
+    results = [None] * len(tasks)
+    for future in as_completed(futures):
+        i = futures[future]
+        res, err, used, metrics = future.result()
+        results[i] = (res, err)
+        USED_SOURCE_FILES.update(used)
+        instrument.merge_state(metrics)
+        progress.update(bar, description=label(tasks[i]))
+        progress.advance(bar)
+    for t, (res, err) in zip(tasks, results):
+        collect_result(kind, t, res, err)
+
+def run_merge(config_tasks, source_files=None, reader=read_source_rules, writer=None, workers=1):
+    """
+    依次执行配置任务与自动发现任务，结果记入 STATS / SUMMARY_ROWS
+    workers > 1 时在进程池中执行 (仅限默认的磁盘读写)，自动发现在配置任务全部完成后进行
+    """
+    pool = None
+    if workers > 1 and reader is read_source_rules and writer is None:
+        shared = shared_inputs(config_tasks)
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker,
+                                   initargs=(shared, (SOURCE_DIR, OUTPUT_DIR, STAGING_DIR)))
+        del shared
+    try:
+        with Progress(
+            SpinnerColumn(),
+            TextColumn("[bold blue]{task.description}"),
+            BarColumn(),
+            TaskProgressColumn(),
+            console=console
+        ) as progress:
 
+            if config_tasks:
+                task_main = progress.add_task("[cyan]Running Config Tasks[/cyan]", total=len(config_tasks))
+                run_phase(progress, task_main, 'config', config_tasks, reader, writer, pool)
+
+            auto_tasks = auto_discover_files(source_files)
+            if auto_tasks:
+                task_auto = progress.add_task("[magenta]Running Auto-Discovery[/magenta]", total=len(auto_tasks))
+                run_phase(progress, task_auto, 'auto', auto_tasks, reader, writer, pool)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+def output_digest(path):
+    """输出文件的内容哈希：忽略每次运行都会变化的 # Date 行，逐行读取"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.startswith(VOLATILE_PREFIX):
+                h.update(line)
+    return h.hexdigest()
+
+def delta_key(rel_output):
+    """合并输出的排序键：IP-CIDR 按地址排序，其余按字符串"""
+    parts = Path(rel_output).parts
+    rule_type = parts[1] if len(parts) > 2 else ''
+    return delta.cidr_key if detect_mode(rule_type, parts[-1]) == 'IP-CIDR' else None
+
+def publish_staged():
+    """
+    把暂存目录中的输出发布到 OUTPUT_DIR：内容未变的文件保留原样 (连同原来的 Date)，
+    有变化的文件用 os.replace 原子替换，本次未产出的旧文件逐个删除
+    """
+    produced = set()
+    written = unchanged = removed = 0
+    for root, _, files in os.walk(STAGING_DIR):
+        for file in files:
+            staged = os.path.join(root, file)
+            rel = os.path.relpath(staged, STAGING_DIR)
+            dst = os.path.join(OUTPUT_DIR, rel)
+            produced.add(normalize_path(rel))
+            if os.path.isfile(dst) and output_digest(dst) == output_digest(staged):
+                unchanged += 1
+                continue
+            delta.record("merge", normalize_path(dst), dst, staged, delta_key(rel))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(staged, dst)
+            written += 1
+
+    for root, _, files in os.walk(OUTPUT_DIR):
+        for file in files:
+            path = os.path.join(root, file)
+            if normalize_path(os.path.relpath(path, OUTPUT_DIR)) not in produced:
+                console.print(f"[dim]🧹 Removing stale output: {path}[/dim]")
+                delta.record("merge", normalize_path(path), path, [])
+                os.remove(path)
+                removed += 1
+    for root, _, _ in os.walk(OUTPUT_DIR, topdown=False):
+        if root != OUTPUT_DIR and not os.listdir(root):
+            os.rmdir(root)
+
+    shutil.rmtree(STAGING_DIR, ignore_errors=True)
+    PUBLISH_STATS.update(written=written, unchanged=unchanged, removed=removed)
+    return PUBLISH_STATS
+
+def print_report():
+    """输出执行汇总表与 GitHub Step Summary"""
     table = Table(title="Execution Summary", header_style="bold magenta")
     table.add_column("File", style="cyan")
     table.add_column("Output Path", style="dim")
     table.add_column("Mode")
     table.add_column("Rules", justify="right", style="green")
+    table.add_column("Pruned", justify="right", style="yellow")
 
     for r in SUMMARY_ROWS:
-        table.add_row(r['file'], r['path'], r['mode'], str(r['opt']))
+        table.add_row(r['file'], r['path'], r['mode'], str(r['opt']), str(r['pruned']))
     
     console.print("\n")
     console.print(table)
+    if PUBLISH_STATS:
+        console.print(f"[dim]💾 Outputs: {PUBLISH_STATS['written']} written, "
+                      f"{PUBLISH_STATS['unchanged']} unchanged, {PUBLISH_STATS['removed']} removed[/dim]")
 
     if os.getenv('GITHUB_STEP_SUMMARY'):
         with open(os.getenv('GITHUB_STEP_SUMMARY'), 'a') as f:
             f.write(f"### 🚀 Rule Report: {STATS['success']} OK, {STATS['failed']} Failed\n\n")
+            if PUBLISH_STATS:
+                f.write(f"_Outputs: {PUBLISH_STATS['written']} written, {PUBLISH_STATS['unchanged']} unchanged, "
+                        f"{PUBLISH_STATS['removed']} removed_\n\n")
             if ERROR_LOGS:
                 f.write("```diff\n" + "\n".join([f"- {e}" for e in ERROR_LOGS]) + "\n```\n")
-            f.write("| File | Output Path | Rules |\n|---|---|---|\n")
+            f.write("| File | Output Path | Rules | Pruned |\n|---|---|---|---|\n")
             for r in SUMMARY_ROWS:
-                f.write(f"| `{r['file']}` | `{r['path']}` | **{r['opt']}** |\n")
+                f.write(f"| `{r['file']}` | `{r['path']}` | **{r['opt']}** | {r['pruned']} |\n")
+
+
+def main():
+    console.rule("[bold blue]🚀 Hybrid Merger (Smart Clean)[/bold blue]")
+
+    if not os.path.exists(CONFIG_FILE):
+        console.print(f"[yellow]⚠️ Warning: Config '{CONFIG_FILE}' not found. Will use Auto-Mode only.[/yellow]")
+    
+    if not os.path.exists(SOURCE_DIR):
+        console.print(f"[bold red]❌ CRITICAL: Directory '{SOURCE_DIR}' not found![/bold red]")
+        sys.exit(1)
+
+    shutil.rmtree(STAGING_DIR, ignore_errors=True)
+    os.makedirs(STAGING_DIR)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    config_tasks = load_config_tasks()
+    run_merge(config_tasks, workers=MERGE_WORKERS)
+    with instrument.span("publish"):
+        publish_staged()
+    print_report()
+    delta.report("merge")
+    instrument.report("merge")
 
     if STATS["failed"] > 0:
         sys.exit(1)
@@ -0,0 +1,188 @@
+import os
+import sys
+import struct
+from cidr import parse_cidr
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"MRS\x01"
+BEHAVIOR = {"domain": 0, "ipcidr": 1}
+BIN_VERSION = 1
+ZSTD_LEVEL = 19
+V4_MAPPED_PREFIX = 0xFFFF << 32
+
+def _set_bit(bm, i, v):
+    while (i >> 6) >= len(bm):
+        bm.append(0)
+    bm[i >> 6] |= v << (i & 63)
+
+def _write_u64_list(out, values):
+    out.append(struct.pack(">q", len(values)))
+    out.append(struct.pack(f">{len(values)}Q", *values))
+
+def valid_domain(domain):
+    """与 mihomo DomainTrie 相同的校验：不能以点结尾，除首段外不能有空段"""
+    if not domain or domain.endswith("."):
+        return False
+    parts = domain.split(".")
+    return all(parts[1:]) and (len(parts) > 1 or parts[0] != "")
+
+def encode_domain(domains):
+    """
+    域名集合 -> DomainSet 二进制 (LOUDS 简洁字典树，键为反转后的域名)
+    返回 (规则条数, 负载字节)
+    """
+    count = 0
+    keys = set()
+    for d in domains:
+        d = d.lower()
+        if not valid_domain(d):
+            continue
+        count += 1
+        if d.startswith("+."):
+            keys.add(d[2:][::-1])
+            d = d[1:]
+        if d.startswith("."):
+            d = "+" + d
+        keys.add(d[::-1])
+    keys = sorted(k.encode() for k in keys)
+
+    leaves, label_bitmap, labels = [], [], bytearray()
+    if keys:
+        l_idx = 0
+        queue = [(0, len(keys), 0)]
+        i = 0
+        while i < len(queue):
+            s, e, col = queue[i]
+            if col == len(keys[s]):
+                s += 1
+                _set_bit(leaves, i, 1)
+            j = s
+            while j < e:
+                frm = j
+                c = keys[frm][col]
+                while j < e and keys[j][col] == c:
+                    j += 1
+                queue.append((frm, j, col + 1))
+                labels.append(c)
+                _set_bit(label_bitmap, l_idx, 0)
+                l_idx += 1
+            _set_bit(label_bitmap, l_idx, 1)
+            l_idx += 1
+            i += 1
+
+    out = [bytes([BIN_VERSION])]
+    _write_u64_list(out, leaves)
+    _write_u64_list(out, label_bitmap)
+    out.append(struct.pack(">q", len(labels)))
+    out.append(bytes(labels))
+    return count, b"".join(out)
+
+def encode_ipcidr(cidrs):
+    """
+    CIDR 列表 -> IpCidrSet 二进制：合并后的区间，v4 以 IPv4 映射地址写入 16 字节
+    返回 (规则条数, 负载字节)
+    """
+    count = 0
+    v4, v6 = [], []
+    for c in cidrs:
+        try:
+            version, start, end, _ = parse_cidr(c)
+        except ValueError:
+            continue
+        count += 1
+        (v4 if version == 4 else v6).append((start, end))
+
+    out = [bytes([BIN_VERSION])]
+    ranges = []
+    for family, offset in ((v4, V4_MAPPED_PREFIX), (v6, 0)):
+        for start, end in _merge(sorted(family)):
+            ranges.append((start | offset, end | offset))
+    out.append(struct.pack(">q", len(ranges)))
+    for start, end in ranges:
+        out.append(start.to_bytes(16, "big"))
+        out.append(end.to_bytes(16, "big"))
+    return count, b"".join(out)
+
+def _merge(ranges):
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def build_payload(rule_type, rules):
+    """生成未压缩的 MRS 内容 (魔数 + 行为 + 条数 + 扩展段 + 规则集二进制)"""
+    if rule_type not in BEHAVIOR:
+        raise ValueError(f"Unsupported rule type: {rule_type}")
+    encoder = encode_domain if rule_type == "domain" else encode_ipcidr
+    count, body = encoder(rules)
+    if count == 0:
+        raise ValueError("empty rule")
+    header = MAGIC + bytes([BEHAVIOR[rule_type]]) + struct.pack(">qq", count, 0)
+    return header + body
+
+def encode_mrs(rule_type, rules):
+    """把内存中的规则列表编码为压缩后的 .mrs 字节 (需要 zstandard)"""
+    if zstandard is None:
+        raise RuntimeError("Native MRS writer requires the 'zstandard' package")
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(build_payload(rule_type, rules))
+
+def write_mrs(rule_type, rules, dst_path):
+    """把内存中的规则列表直接编码为 .mrs 文件"""
+    data = encode_mrs(rule_type, rules)
+    tmp_path = dst_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, dst_path)
+
+def read_payload(mrs_path):
+    """解压 .mrs 文件得到原始内容，用于兼容性校验"""
+    if zstandard is None:
+        raise RuntimeError("Reading MRS files requires the 'zstandard' package")
+    with open(mrs_path, "rb") as f:
+        return zstandard.ZstdDecompressor().stream_reader(f).read()
+
+def read_text_rules(path):
+    rules = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#") or line.startswith("//"):
+                continue
+            rules.append(line)
+    return rules
+
+def verify(src_root="merged-rules", mrs_root="merged-rules-mrs"):
+    """兼容性校验：逐个比较原生编码结果与已有 .mrs 解压后的字节"""
+    total, failed = 0, []
+    for root, _, files in os.walk(mrs_root):
+        for f in sorted(files):
+            if not f.endswith(".mrs"):
+                continue
+            mrs_path = os.path.join(root, f)
+            rel = os.path.relpath(mrs_path, mrs_root)
+            src_path = os.path.join(src_root, os.path.splitext(rel)[0] + ".txt")
+            if not os.path.exists(src_path):
+                continue
+            rule_type = "ipcidr" if "ipcidr" in rel.split(os.sep) else "domain"
+            total += 1
+            expected = read_payload(mrs_path)
+            actual = build_payload(rule_type, read_text_rules(src_path))
+            status = "OK" if actual == expected else "MISMATCH"
+            if actual != expected:
+                failed.append(rel)
+            print(f"[{status}] {rel} ({len(actual)} bytes)")
+    print(f"{total - len(failed)}/{total} files byte-identical")
+    return not failed
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "verify":
+        sys.exit(0 if verify(*sys.argv[2:4]) else 1)
+    print("Usage: python scripts/mrs.py verify [merged-rules] [merged-rules-mrs]")
@@ -3,10 +3,24 @@ import json
 import subprocess
 import time
 import sys
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
 
 PLAN_FILE = "workflow_plan.json"
 SUMMARY_FILE = os.getenv("GITHUB_STEP_SUMMARY")
+# github: 通过 gh workflow run 触发；fake: 内存模拟的运行后端；local: 直接以子进程运行各步骤的 Python 入口
+EXECUTOR = os.getenv("ORCHESTRATOR_EXECUTOR", "github").lower()
+FIND_TIMEOUT = float(os.getenv("ORCHESTRATOR_FIND_TIMEOUT", "60"))
+# 等待单个运行结束的最长时间 (秒)，默认与 GitHub Actions 作业的 6 小时上限一致；步骤可用 "timeout" 覆盖
+RUN_TIMEOUT = float(os.getenv("ORCHESTRATOR_RUN_TIMEOUT", "21600"))
+FAKE_DISPATCH_DELAY = float(os.getenv("FAKE_DISPATCH_DELAY", "0.05"))
+FAKE_RUN_DURATION = float(os.getenv("FAKE_RUN_DURATION", "0.2"))
+MAX_PARALLEL = int(os.getenv("ORCHESTRATOR_PARALLEL", "4"))
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PRINT_LOCK = threading.Lock()
 
 class Style:
     RESET = "\033[0m"
@@ -34,28 +48,129 @@ def print_banner(text):
     print(f" {text}")
     print(f"{'='*60}{Style.RESET}\n")
 
-def get_latest_run(workflow_file, retry=3):
-    """尝试多次获取最新的 Run ID"""
-    for _ in range(retry):
-        time.sleep(3)
+def poll(check, initial=0.01, factor=2.0, max_interval=5.0, timeout=None):
+    """自适应退避轮询：从毫秒级间隔开始逐步放大，check 返回非 None 即结束"""
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    interval = initial
+    while True:
+        result = check()
+        if result is not None:
+            return result
+        if deadline is not None and time.monotonic() >= deadline:
+            return None
+        wait_s = interval if deadline is None else min(interval, max(deadline - time.monotonic(), 0))
+        time.sleep(wait_s)
+        interval = min(interval * factor, max_interval)
+
+class RunBackend(ABC):
+    """
+    工作流运行后端接口
+    run 信息统一为 {id, url, status, conclusion}，status 为 completed 时 conclusion 有效
+    """
+    find_initial = 0.01
+    wait_initial = 0.01
+    max_interval = 5.0
+
+    def __init__(self, plan=()):
+        pass
+
+    @abstractmethod
+    def dispatch(self, workflow_file, token):
+        """以令牌派发一次工作流运行"""
+
+    @abstractmethod
+    def find_run(self, workflow_file, token):
+        """按派发令牌查找对应的运行实例，尚未出现时返回 None"""
+
+    @abstractmethod
+    def get_run(self, run_id):
+        """查询运行实例的最新状态，查询失败时返回 None"""
+
+class GhBackend(RunBackend):
+    """gh CLI 后端：令牌通过 dispatch_id 输入写入 run-name，据此关联运行实例"""
+    find_initial = 0.5
+    wait_initial = 2.0
+    max_interval = 15.0
+    FIELDS = "databaseId,url,status,conclusion,displayTitle"
+
+    def dispatch(self, workflow_file, token):
+        subprocess.run(["gh", "workflow", "run", workflow_file, "-f", f"dispatch_id={token}"], check=True)
+
+    def _normalize(self, data):
+        return {"id": data['databaseId'], "url": data['url'],
+                "status": data['status'], "conclusion": data.get('conclusion') or ""}
+
+    def find_run(self, workflow_file, token):
+        cmd = ["gh", "run", "list", "--workflow", workflow_file, "--event", "workflow_dispatch",
+               "--limit", "20", "--json", self.FIELDS]
+        try:
+            runs = json.loads(subprocess.check_output(cmd).decode())
+        except (subprocess.CalledProcessError, ValueError):
+            return None
+        for data in runs:
+            if token in (data.get('displayTitle') or ""):
+                return self._normalize(data)
+        return None
+
+    def get_run(self, run_id):
+        cmd = ["gh", "run", "view", str(run_id), "--json", self.FIELDS]
         try:
-            cmd = ["gh", "run", "list", "--workflow", workflow_file, "--limit", "1", "--json", "databaseId,url,status,conclusion"]
-            res = subprocess.check_output(cmd).decode()
-            data = json.loads(res)
-            if data: return data[0]
-        except:
-            pass
-    return None
+            return self._normalize(json.loads(subprocess.check_output(cmd).decode()))
+        except (subprocess.CalledProcessError, ValueError):
+            return None
+
+class FakeBackend(RunBackend):
+    """
+    本地模拟后端：派发后延迟出现运行实例，按设定时长结束
+    步骤可通过 "fake": {"duration": 秒, "conclusion": "failure"} 覆盖；用于离线测量调度开销
+    """
+
+    def __init__(self, plan=()):
+        super().__init__(plan)
+        self.lock = threading.Lock()
+        self.runs = {}
+        self.overrides = {t['filename']: t.get('fake', {}) for t in plan}
+
+    def dispatch(self, workflow_file, token):
+        cfg = self.overrides.get(workflow_file, {})
+        now = time.monotonic()
+        visible_at = now + cfg.get('dispatch_delay', FAKE_DISPATCH_DELAY)
+        with self.lock:
+            self.runs[token] = {
+                "id": f"fake-{len(self.runs) + 1}",
+                "workflow": workflow_file,
+                "visible_at": visible_at,
+                "completed_at": visible_at + cfg.get('duration', FAKE_RUN_DURATION),
+                "conclusion": cfg.get('conclusion', 'success'),
+            }
+
+    def _view(self, run):
+        done = time.monotonic() >= run['completed_at']
+        return {"id": run['id'], "url": "", "status": "completed" if done else "in_progress",
+                "conclusion": run['conclusion'] if done else "", "completed_at": run['completed_at']}
+
+    def find_run(self, workflow_file, token):
+        with self.lock:
+            run = self.runs.get(token)
+        if run and run['workflow'] == workflow_file and time.monotonic() >= run['visible_at']:
+            return self._view(run)
+        return None
+
+    def get_run(self, run_id):
+        with self.lock:
+            run = next((r for r in self.runs.values() if r['id'] == run_id), None)
+        return self._view(run) if run else None
 
 def format_time(seconds):
     if seconds < 60: return f"{int(seconds)}s"
     return f"{int(seconds // 60)}m {int(seconds % 60)}s"
 
 def generate_mermaid_chart(results):
-    """生成 Mermaid 流程图代码"""
+    """生成 Mermaid 流程图代码 (按 needs 连线)"""
     graph = ["graph LR"]
-    graph.append("    START((🚀 开始)) --> N0")
-    
+    node_of = {res['id']: f"N{i}" for i, res in enumerate(results)}
+    required = set(n for res in results for n in res['needs'])
+
     for i, res in enumerate(results):
         status_style = "stroke:#333,stroke-width:2px"
         if res['status'] == 'success':
@@ -65,21 +180,24 @@ def generate_mermaid_chart(results):
         elif res['status'] == 'skipped':
             status_style = "stroke-dasharray: 5 5"
 
-        node_id = f"N{i}"
-        safe_name = res['name'].replace(" ", "_")
+        node_id = node_of[res['id']]
         time_label = f"<br/>⏱️ {format_time(res['duration'])}" if res['duration'] > 0 else ""
         
         graph.append(f"    {node_id}[{res['name']}{time_label}]")
         graph.append(f"    style {node_id} {status_style}")
 
-        if i < len(results) - 1:
-            graph.append(f"    {node_id} --> N{i+1}")
-    
-    last_status = results[-1]['status'] if results else 'success'
-    end_node = "END_OK(((✅ 完成)))" if last_status == 'success' else "END_FAIL(((❌ 中断)))"
-    graph.append(f"    N{len(results)-1} --> {end_node}")
+        if not res['needs']:
+            graph.append(f"    START((🚀 开始)) --> {node_id}")
+        for need in res['needs']:
+            graph.append(f"    {node_of[need]} --> {node_id}")
+
+    is_ok = not any(r['status'] == 'failure' for r in results)
+    end_node = "END_OK(((✅ 完成)))" if is_ok else "END_FAIL(((❌ 中断)))"
+    for res in results:
+        if res['id'] not in required:
+            graph.append(f"    {node_of[res['id']]} --> {end_node}")
     
-    if last_status == 'success':
+    if is_ok:
         graph.append(f"    style END_OK fill:#2da44e,stroke:#fff,color:#fff")
     else:
         graph.append(f"    style END_FAIL fill:#cf222e,stroke:#fff,color:#fff")
@@ -89,8 +207,7 @@ def generate_mermaid_chart(results):
 def write_summary(results, total_time):
     if not SUMMARY_FILE: return
 
-    success_count = sum(1 for r in results if r['status'] == 'success')
-    is_all_pass = (success_count == len(results)) and len(results) > 0
+    is_all_pass = len(results) > 0 and not any(r['status'] == 'failure' for r in results)
     md = f"# 🕹️ 自动化构建控制台\n\n"
 
     if is_all_pass:
@@ -103,8 +220,8 @@ def write_summary(results, total_time):
     md += generate_mermaid_chart(results)
     md += "\n```\n\n"
     md += "### 📋 任务详细报告\n"
-    md += "| 步骤 | 任务名 | 结果 | 耗时 | 日志链接 |\n"
-    md += "| :--- | :--- | :---: | :---: | :--- |\n"
+    md += "| 步骤 | 任务名 | 依赖 | 结果 | 耗时 | 日志链接 |\n"
+    md += "| :--- | :--- | :--- | :---: | :---: | :--- |\n"
     
     for i, res in enumerate(results):
         icon = Style.ICON_WAIT
@@ -114,11 +231,186 @@ def write_summary(results, total_time):
         
         link = f"[🔗 点击查看]({res['url']})" if res['url'] else "-"
         
-        md += f"| **{i+1}** | {res['name']} | {icon} | {format_time(res['duration'])} | {link} |\n"
+        needs = ", ".join(f"`{n}`" for n in res['needs']) or "-"
+        md += f"| **{i+1}** | {res['name']} | {needs} | {icon} | {format_time(res['duration'])} | {link} |\n"
 
     with open(SUMMARY_FILE, "w", encoding="utf-8") as f:
         f.write(md)
 
+def normalize_plan(plan):
+    """
+    补全每个步骤的 id 与 needs 并检查依赖关系
+    整个计划都没有声明 needs 时按原顺序串行执行 (兼容旧格式)
+    """
+    has_deps = any('needs' in t for t in plan)
+    ids = set()
+    for i, task in enumerate(plan):
+        task.setdefault('id', os.path.splitext(task['filename'])[0])
+        if task['id'] in ids:
+            raise ValueError(f"Duplicate step id: {task['id']}")
+        ids.add(task['id'])
+        if has_deps:
+            needs = task.get('needs', [])
+            task['needs'] = [needs] if isinstance(needs, str) else list(needs)
+        else:
+            task['needs'] = [plan[i - 1]['id']] if i else []
+
+    for task in plan:
+        for need in task['needs']:
+            if need not in ids:
+                raise ValueError(f"Step '{task['id']}' needs unknown step '{need}'")
+
+    done = set()
+    remaining = list(plan)
+    while remaining:
+        ready = [t for t in remaining if all(n in done for n in t['needs'])]
+        if not ready:
+            raise ValueError(f"Dependency cycle among: {', '.join(t['id'] for t in remaining)}")
+        for t in ready:
+            done.add(t['id'])
+            remaining.remove(t)
+    return plan
+
+def run_remote(backend, task, res):
+    """远程执行器：带令牌派发工作流，退避轮询找到对应运行实例并等待其结束"""
+    token = f"{task['id']}-{uuid.uuid4().hex[:12]}"
+    with PRINT_LOCK:
+        print(f"{Style.ICON_RUN} 触发 {task['name']} ({task['filename']}, 令牌 {token})")
+    backend.dispatch(task['filename'], token)
+
+    run_info = poll(lambda: backend.find_run(task['filename'], token),
+                    initial=backend.find_initial, max_interval=backend.max_interval, timeout=FIND_TIMEOUT)
+    if not run_info:
+        with PRINT_LOCK:
+            print(f"::warning::{task['name']}: 未找到令牌 {token} 对应的运行实例，无法追踪状态")
+        res['status'] = 'unknown'
+        return
+
+    res['url'] = run_info['url']
+    with PRINT_LOCK:
+        print(f"🔗 {task['name']} 已创建: {run_info['url'] or run_info['id']}")
+
+    if not task.get('wait', True):
+        with PRINT_LOCK:
+            print(f"⚡ {task['name']}: 异步任务 - 已触发但不等待结果")
+        res['status'] = 'success'
+        return
+
+    def completed():
+        info = backend.get_run(run_info['id'])
+        return info if info and info['status'] == 'completed' else None
+
+    timeout = float(task.get('timeout', RUN_TIMEOUT))
+    final = poll(completed, initial=backend.wait_initial, max_interval=backend.max_interval, timeout=timeout)
+    if final is None:
+        with PRINT_LOCK:
+            print(f"::error::{task['name']}: 等待 {format_time(timeout)} 仍未结束，按失败处理")
+        res['status'] = 'failure'
+        return
+    if 'completed_at' in final:
+        res['overhead'] = max(time.monotonic() - final['completed_at'], 0)
+    ok = final['conclusion'] == 'success'
+    with PRINT_LOCK:
+        if ok:
+            print(f"{Style.GREEN}✅ {task['name']} 执行成功{Style.RESET}")
+        else:
+            print(f"{Style.RED}❌ {task['name']} 执行失败 ({final['conclusion']}){Style.RESET}")
+    res['status'] = 'success' if ok else 'failure'
+
+def run_local(task, res):
+    """本地执行器：依次以子进程运行步骤的 Python 入口，输出收齐后整体打印，避免并行时交错"""
+    entries = task.get('local')
+    if not entries:
+        with PRINT_LOCK:
+            print(f"🚫 [跳过] {task['name']} (无本地入口)")
+        res['status'] = 'skipped'
+        return
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (SCRIPTS_DIR, env.get('PYTHONPATH')) if p)
+    env.setdefault('GIT_PUSH', 'false')
+
+    output = []
+    status = 'success'
+    for entry in ([entries] if isinstance(entries, str) else entries):
+        args = entry.split() if isinstance(entry, str) else list(entry)
+        proc = subprocess.run([sys.executable] + args, env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        output.append(f"$ python {' '.join(args)}\n{proc.stdout}")
+        if proc.returncode != 0:
+            output.append(f"{Style.RED}❌ 退出码 {proc.returncode}{Style.RESET}\n")
+            status = 'failure'
+            break
+
+    with PRINT_LOCK:
+        log_group_start(f"{task['name']} ({status})")
+        print("".join(output), end="")
+        log_group_end()
+    res['status'] = status
+
+BACKENDS = {"github": GhBackend, "fake": FakeBackend}
+
+def make_executor(name, plan):
+    if name == "local":
+        return run_local
+    backend = BACKENDS[name](plan)
+    return lambda task, res: run_remote(backend, task, res)
+
+def execute_step(execute, task, res, start_total):
+    res['start'] = time.time() - start_total
+    job_start = time.time()
+    try:
+        execute(task, res)
+    except Exception as e:
+        print(f"::error::系统异常: {e}")
+        res['status'] = 'failure'
+    res['duration'] = time.time() - job_start
+    if res['status'] == 'failure':
+        print(f"::error::步骤失败: {task['name']}，依赖它的后续任务将被跳过")
+
+def schedule(plan, execute, start_total):
+    """依赖满足即并发执行；任一依赖未成功则跳过 (与 GitHub Actions 的 needs 语义一致)"""
+    results = {t['id']: {
+        "id": t['id'],
+        "name": t['name'],
+        "filename": t['filename'],
+        "needs": t['needs'],
+        "status": "pending",
+        "url": "",
+        "start": 0,
+        "duration": 0,
+        "overhead": None
+    } for t in plan}
+    pending = list(plan)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(MAX_PARALLEL, 1)) as pool:
+        while pending or running:
+            changed = True
+            while changed:
+                changed = False
+                for task in list(pending):
+                    states = [results[n]['status'] for n in task['needs']]
+                    if all(s in ('success', 'unknown') for s in states):
+                        results[task['id']]['status'] = 'running'
+                        running[pool.submit(execute_step, execute, task, results[task['id']], start_total)] = task
+                    elif any(s in ('failure', 'skipped') for s in states):
+                        results[task['id']]['status'] = 'skipped'
+                        print(f"🚫 [跳过] {task['name']} (因上游失败)")
+                        changed = True
+                    else:
+                        continue
+                    pending.remove(task)
+
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                running.pop(future)
+                future.result()
+
+    return [results[t['id']] for t in plan]
+
 def run():
     start_total = time.time()
     
@@ -126,82 +418,33 @@ def run():
         print("::error::❌ 缺少配置文件 workflow_plan.json")
         exit(1)
 
+    if EXECUTOR not in ("local",) + tuple(BACKENDS):
+        print(f"::error::❌ 未知执行器: {EXECUTOR} (可选: local, {', '.join(BACKENDS)})")
+        exit(1)
+
     with open(PLAN_FILE, 'r') as f:
-        plan = json.load(f)
+        try:
+            plan = normalize_plan(json.load(f))
+        except ValueError as e:
+            print(f"::error::❌ 计划文件无效: {e}")
+            exit(1)
 
-    print_banner(f"启动编排系统 - 计划任务数: {len(plan)}")
+    print_banner(f"启动编排系统 - 计划任务数: {len(plan)} (执行器: {EXECUTOR}, 并发: {MAX_PARALLEL})")
     
-    results = []
-    abort_flow = False
-
-    for idx, task in enumerate(plan):
-        job_start = time.time()
-        res = {
-            "name": task['name'],
-            "filename": task['filename'],
-            "status": "pending",
-            "url": "",
-            "duration": 0
-        }
-        
-        if abort_flow:
-            res['status'] = 'skipped'
-            print(f"🚫 [跳过] {task['name']} (因上游失败)")
-            results.append(res)
-            continue
-            
-        log_group_start(f"正在执行 [{idx+1}/{len(plan)}]: {task['name']}")
-        print(f"📄 目标文件: {task['filename']}")
-        
-        try:
-            print(f"{Style.ICON_RUN} 正在发送触发指令...")
-            subprocess.run(["gh", "workflow", "run", task['filename']], check=True)
-            
-            print("⏳ 等待 GitHub 创建运行实例...")
-            run_info = get_latest_run(task['filename'])
-            
-            if run_info:
-                res['url'] = run_info['url']
-                run_id = run_info['databaseId']
-                print(f"🔗 任务已创建: {run_info['url']} (ID: {run_id})")
-
-                if task.get('wait', True):
-                    print(f"\n{Style.YELLOW}>>> 进入同步监控模式 (实时日志将流式传输) <<<{Style.RESET}")
-                    subprocess.run(["gh", "run", "watch", str(run_id), "--exit-status"], check=True)
-                    print(f"\n{Style.GREEN}✅ 任务执行成功{Style.RESET}")
-                    res['status'] = 'success'
-                else:
-                    print("⚡ 异步任务 - 已触发但不等待结果")
-                    res['status'] = 'success'
-            else:
-                print("::warning::无法获取 Run ID，无法追踪状态")
-                res['status'] = 'unknown'
-
-        except subprocess.CalledProcessError:
-            print(f"\n{Style.RED}❌ 任务执行失败！{Style.RESET}")
-            res['status'] = 'failure'
-            abort_flow = True
-            print("::error::关键路径中断，停止后续任务")
-
-        except Exception as e:
-            print(f"::error::系统异常: {e}")
-            res['status'] = 'failure'
-            abort_flow = True
-
-        res['duration'] = time.time() - job_start
-        results.append(res)
-        log_group_end()
-        if idx < len(plan) - 1 and not abort_flow:
-            time.sleep(2)
+    results = schedule(plan, make_executor(EXECUTOR, plan), start_total)
 
     total_time = time.time() - start_total
     write_summary(results, total_time)
+
+    overheads = [r['overhead'] for r in results if r['overhead'] is not None]
+    if overheads:
+        print(f"⏱️ 完成检测延迟: 合计 {sum(overheads) * 1000:.0f}ms, 最大 {max(overheads) * 1000:.0f}ms ({len(overheads)} 个步骤)")
     
-    if abort_flow:
+    if any(r['status'] == 'failure' for r in results):
         print_banner("❌ 流程异常结束")
         exit(1)
     else:
-        print_banner("✅ 流程圆满完成")
+        print_banner(f"✅ 流程圆满完成 ({format_time(total_time)})")
 
 if __name__ == "__main__":
     run()
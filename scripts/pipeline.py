@@ -0,0 +1,232 @@
+import io
+import os
+import sys
+import time
+import logging
+from pathlib import Path
+import main as sync
+import merger
+import convert_mrs
+import check_conflicts
+import gen_readme
+import mrs
+import instrument
+import delta
+from domainset import DomainSet
+
+VOLATILE_PREFIX = b"# Date:"
+
+logger = logging.getLogger(__name__)
+
+class RuleStore:
+    """
+    内存中的输出文件：路径 -> 字节内容
+    各阶段之间直接传递规则列表，flush 时只写入正文有变化的文件
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.rules = {}
+
+    def put(self, path, data, rules=None):
+        key = Path(path).as_posix()
+        self.files[key] = data
+        if rules is not None:
+            self.rules[key] = rules
+
+    def get_rules(self, path):
+        return self.rules.get(Path(path).as_posix())
+
+    def flush(self):
+        """写入有变化的文件 (忽略 # Date 行)，返回 (写入数, 未变化数)"""
+        written = unchanged = 0
+        for key, data in sorted(self.files.items()):
+            if same_body(key, data):
+                unchanged += 1
+                continue
+            os.makedirs(os.path.dirname(key), exist_ok=True)
+            tmp_path = key + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, key)
+            written += 1
+        return written, unchanged
+
+def strip_volatile(data):
+    return b"".join(l for l in io.BytesIO(data) if not l.startswith(VOLATILE_PREFIX))
+
+def same_body(path, data):
+    try:
+        with open(path, 'rb') as f:
+            old = f.read()
+    except OSError:
+        return False
+    return old == data or strip_volatile(old) == strip_volatile(data)
+
+def remove_orphans(root, expected, suffix):
+    """删除 root 下不在 expected 中的输出文件，以及空目录"""
+    if not os.path.exists(root):
+        return
+    for dirpath, _, files in os.walk(root):
+        for f in files:
+            path = Path(dirpath, f).as_posix()
+            if f.endswith(suffix) and path not in expected:
+                logger.info(f"Deleting orphan: {path}")
+                os.remove(path)
+    for dirpath, _, _ in os.walk(root, topdown=False):
+        if dirpath != root and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+def run_sync(store):
+    """阶段 1：下载并清洗，新结果只保存在内存中"""
+    tasks = sync.resolve_targets(sync.parse_sources())
+    logger.info(f"Loaded {len(tasks)} sources.")
+    fetch_cache = sync.load_fetch_cache()
+
+    def save(abs_path, result):
+        store.put(abs_path, sync.ruleset_bytes(result), result)
+
+    expected_files = sync.sync_sources(tasks, fetch_cache, save)
+    live_urls = set(t['url'] for t in tasks)
+    fetch_cache = {u: e for u, e in fetch_cache.items() if u in live_urls}
+    return [Path(p).as_posix() for p in expected_files], fetch_cache
+
+def run_merge(store, source_files):
+    """阶段 2：从内存 (或未更新的磁盘文件) 读取输入并合并"""
+    def reader(rel_input):
+        rules = store.get_rules(os.path.join(merger.SOURCE_DIR, rel_input))
+        if rules is None:
+            return merger.read_source_rules(rel_input)
+        if isinstance(rules, DomainSet):
+            return rules
+        return [r.encode('utf-8') for r in merger.clean_rule_lines(rules)]
+
+    def writer(rel_output, content, final_list):
+        dst = os.path.join(merger.OUTPUT_DIR, rel_output)
+        delta.record("merge", Path(dst).as_posix(), dst, final_list, merger.delta_key(rel_output))
+        store.put(os.path.join(merger.OUTPUT_DIR, rel_output), content.encode('utf-8'), final_list)
+
+    rel_sources = sorted(os.path.relpath(p, merger.SOURCE_DIR) for p in source_files)
+    merger.run_merge(merger.load_config_tasks(), rel_sources, reader, writer)
+    merger.print_report()
+    return sorted(k for k in store.files if k.startswith(merger.OUTPUT_DIR + "/"))
+
+def run_check(store, merged_files):
+    """阶段 3：跨策略冲突检查，直接读取内存中的合并结果；STRIP_CONFLICTS 时剔除的结果也写回内存"""
+    start = time.time()
+    entries = []
+    for key in merged_files:
+        entry = check_conflicts.classify(key)
+        if entry is None:
+            continue
+        entry['header'], entry['rules'] = check_conflicts.split_rules(store.files[key].decode('utf-8').splitlines())
+        entries.append(entry)
+    if not entries:
+        logger.info("No merged files to check.")
+        return
+
+    def write(path, text, kept):
+        store.put(path, text.encode('utf-8'), kept)
+
+    rows, stripped = check_conflicts.find_conflicts(entries, check_conflicts.STRIP_MODE, write)
+    check_conflicts.print_report(entries, rows, stripped, time.time() - start)
+
+def run_convert(store, merged_files):
+    """阶段 4：直接从内存中的规则列表编码 .mrs，沿用 convert_mrs 的构建缓存"""
+    build_cache = convert_mrs.load_build_cache()
+    new_cache = {}
+    expected = set()
+    stats = {"success": 0, "cached": 0, "failed": 0, "skipped": 0, "total": len(merged_files)}
+
+    for idx, src in enumerate(merged_files, 1):
+        rel_path = os.path.relpath(src, merger.OUTPUT_DIR)
+        prefix = f"[{idx}/{len(merged_files)}]"
+        rule_type = convert_mrs.get_rule_type(rel_path.split(os.sep))
+        rules = store.get_rules(src)
+        if not rule_type or not rules:
+            logger.info(f"{prefix} SKIP: {rel_path} ({'No Valid Rules' if rule_type else 'Unknown Type'})")
+            stats["skipped"] += 1
+            continue
+
+        dst_rel = os.path.splitext(rel_path)[0] + ".mrs"
+        dst_path = os.path.join(convert_mrs.DST_ROOT, dst_rel)
+        dst_key = dst_rel.replace(os.sep, "/")
+        key = convert_mrs.cache_key(convert_mrs.stream_digest(io.BytesIO(store.files[src])),
+                                    rule_type, convert_mrs.NATIVE_VERSION)
+        entry = build_cache.get(dst_key)
+        if entry and entry.get("key") == key and os.path.exists(dst_path):
+            logger.info(f"{prefix} CACHED: {rel_path} (unchanged)")
+            stats["cached"] += 1
+        else:
+            try:
+                with instrument.span("encode", key=rel_path):
+                    store.put(dst_path, mrs.encode_mrs(rule_type, rules))
+            except Exception as e:
+                logger.error(f"::error::{prefix} ERR: {rel_path} ({e})")
+                stats["failed"] += 1
+                continue
+            logger.info(f"{prefix} OK: {rel_path} -> MRS")
+            stats["success"] += 1
+        expected.add(os.path.normpath(dst_path))
+        new_cache[dst_key] = {"key": key, "version": convert_mrs.NATIVE_VERSION}
+    return stats, expected, new_cache
+
+def main():
+    start_time = time.time()
+    push = "--push" in sys.argv[1:]
+    if mrs.zstandard is None:
+        logger.error("::error::The single-process pipeline requires the 'zstandard' package (or use the per-stage workflows).")
+        sys.exit(1)
+
+    store = RuleStore()
+
+    logger.info("::group::📡 Stage 1: Sync")
+    with instrument.span("sync"):
+        expected_sources, fetch_cache = run_sync(store)
+    logger.info("::endgroup::")
+    sync.generate_summary()
+
+    logger.info("::group::🚀 Stage 2: Merge")
+    with instrument.span("merge"):
+        merged_files = run_merge(store, expected_sources)
+    logger.info("::endgroup::")
+
+    logger.info("::group::🔎 Stage 3: Conflict Check")
+    with instrument.span("check"):
+        run_check(store, merged_files)
+    logger.info("::endgroup::")
+
+    logger.info("::group::🍭 Stage 4: Convert MRS")
+    with instrument.span("convert"):
+        convert_stats, expected_mrs, build_cache = run_convert(store, merged_files)
+    logger.info("::endgroup::")
+
+    logger.info("::group::💾 Writing Outputs")
+    with instrument.span("flush"):
+        written, unchanged = store.flush()
+    logger.info(f"Wrote {written} files, {unchanged} unchanged.")
+    sync.save_fetch_cache(fetch_cache)
+    remove_orphans(str(sync.RULESETS_DIR), set(expected_sources), ".txt")
+    remove_orphans(merger.OUTPUT_DIR, set(merged_files), ".txt")
+    convert_mrs.remove_stale_outputs(expected_mrs)
+    convert_mrs.save_build_cache(build_cache)
+    logger.info("::endgroup::")
+    convert_mrs.write_summary(convert_stats, time.time() - start_time)
+
+    with instrument.span("readme"):
+        gen_readme.main()
+    delta.report("sync")
+    delta.report("merge")
+    instrument.report("pipeline")
+
+    strict_mode = os.getenv('STRICT_MODE', 'false').lower() == 'true'
+    sync_failed = len(sync.stats.download_errors) + len(sync.stats.parse_errors)
+    failed = merger.STATS["failed"] + convert_stats["failed"] + (sync_failed if strict_mode else 0)
+    logger.info(f"🎉 Pipeline finished in {time.time() - start_time:.2f}s")
+    if failed > 0:
+        sys.exit(1)
+    if push:
+        sync.git_push()
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,38 @@
+import os
 import sys
 import re
-import ipaddress
+import atexit
 import base64
 import binascii
+import multiprocessing
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor
+import cidr
+import instrument
+from domainset import DomainSet
+
+PARALLEL_WORKERS = int(os.getenv('PROCESSOR_WORKERS', str(os.cpu_count() or 1)))
+PARALLEL_THRESHOLD = int(os.getenv('PARALLEL_THRESHOLD', '50000'))
+PARALLEL_BATCH = 20000
+CHUNK_SIZE = 64 * 1024
+SNIFF_BYTES = 64 * 1024
+SNIFF_LINES = 50
+B64_ALPHABET = re.compile(rb'^[A-Za-z0-9+/=]*$')
+YAML_PAYLOAD = re.compile(r'^\s*payload:', re.IGNORECASE)
+
+IPV4_CHECK = re.compile(r'^\d{1,3}(\.\d{1,3}){3}$')
+# \n / \r 之外 str.splitlines 也会切分的字符 (\x85 也可能只是 UTF-8 多字节字符的一部分，此时仅多走一次慢路径)
+OTHER_BREAKS = re.compile(rb'[\x0b\x0c\x1c-\x1e\x85]|\xe2\x80[\xa8\xa9]')
+DOMAIN_PREFIX = re.compile(r'full:|domain:|host:|keyword:|regexp:|domain-suffix:|domain-keyword:|\+\.')
+DOMAIN_WILDCARD = re.compile(r'^(\*\.|\+\.|\.)')
+DOMAIN_CHARSET = re.compile(r'[a-z0-9._-]+')
+# 快路径：可选前缀 + 可选通配符 + 纯 ASCII 域名字符；主体允许为空，
+# 保证贪婪匹配与逐步剥离前缀的结果一致 (不会回溯出不同的切分)
+DOMAIN_FAST = re.compile(
+    r'(?:full:|domain:|host:|keyword:|regexp:|domain-suffix:|domain-keyword:|\+\.)?'
+    r'(?:\*\.|\+\.|\.)?'
+    r'([a-z0-9._-]*)'
+)
 
 def safe_decode(binary_data):
     """智能解码：尝试 UTF-8，失败则回退"""
@@ -35,135 +65,278 @@ def explicit_base64_decode(text):
         pass
     return text
 
+def iter_entries(content_lines):
+    """逐行状态机：从文本行迭代器中产出规则条目 (YAML 探测只看前 50 行)"""
+    content_lines = iter(content_lines)
+    head = []
+    for line in content_lines:
+        head.append(line)
+        if len(head) >= SNIFF_LINES: break
+    has_payload = any(YAML_PAYLOAD.match(l) for l in head)
+    in_payload = False
+
+    for source in (head, content_lines):
+        for line in source:
+            line = line.strip()
+            if not line: continue
+            if line.startswith('#') or line.startswith('!'): continue
+            if ' #' in line: line = line.split(' #')[0].strip()
+
+            if has_payload:
+                if YAML_PAYLOAD.match(line):
+                    in_payload = True
+                    m = re.search(r'\[(.*)\]', line)
+                    if m:
+                        for x in m.group(1).split(','):
+                            yield x.strip("'\" ")
+                    continue
+
+                if in_payload:
+                    if re.match(r'^[a-zA-Z0-9_-]+:', line):
+                        in_payload = False
+                        continue
+                    if line.startswith('- '):
+                        yield line[2:].strip("'\" ")
+                    elif line.startswith('-'):
+                        yield line[1:].strip("'\" ")
+                continue
+
+            if line.startswith('- '):
+                yield line[2:].strip("'\" ")
+            else:
+                yield line.strip("'\" ")
+
 def parse_lines(raw_content):
     """全能解析器：处理 YAML, Hosts, List, Base64"""
     content = explicit_base64_decode(raw_content)
-    lines = []
-    
-    in_payload = False
-    yaml_payload_pattern = re.compile(r'^\s*payload:', re.IGNORECASE)
-    content_lines = content.splitlines()
-    has_payload = any(yaml_payload_pattern.match(l) for l in content_lines[:50])
+    return list(iter_entries(content.splitlines()))
 
-    for line in content_lines:
-        line = line.strip()
-        if not line: continue
-        if line.startswith('#') or line.startswith('!'): continue
-        if ' #' in line: line = line.split(' #')[0].strip()
-        
-        if has_payload:
-            if yaml_payload_pattern.match(line):
-                in_payload = True
-                m = re.search(r'\[(.*)\]', line)
-                if m:
-                    for x in m.group(1).split(','):
-                        lines.append(x.strip("'\" "))
-                continue
-            
-            if in_payload:
-                if re.match(r'^[a-zA-Z0-9_-]+:', line):
-                    in_payload = False
-                    continue
-                if line.startswith('- '):
-                    lines.append(line[2:].strip("'\" "))
-                elif line.startswith('-'):
-                    lines.append(line[1:].strip("'\" "))
-            continue 
-        
-        if line.startswith('- '):
-            lines.append(line[2:].strip("'\" "))
-        else:
-            lines.append(line.strip("'\" "))
-            
-    return lines
+def iter_chunks(fileobj, chunk_size=CHUNK_SIZE):
+    """按块读取文件对象 (文件 / stdin / BytesIO)"""
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk: break
+        yield chunk
 
-def process_domain(lines):
+def decode_line(raw):
+    for codec in ['utf-8', 'gb18030', 'latin1']:
+        try:
+            return raw.decode(codec)
+        except Exception:
+            continue
+    return ""
+
+def _split_raw_lines(data):
     """
-    智能域名清洗 (已修复 full: 等前缀问题)
+    按 \r\n / \r / \n 切分 (与 splitlines 一样，末尾的换行不产生空行)
+    可能含其它 Unicode 换行符的块在解码后再用 splitlines 细分
+    """
+    if b'\r' in data:
+        data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    parts = data.split(b'\n')
+    if not parts[-1]:
+        parts.pop()
+    if OTHER_BREAKS.search(data) is None:
+        for raw in parts:
+            yield decode_line(raw)
+    else:
+        for raw in parts:
+            yield from decode_line(raw).splitlines() or ['']
+
+def iter_text_lines(chunks):
+    """
+    把字节块切分为文本行，内存只占用一个块
+    与 str.splitlines 一致：\r\n、单独的 \r 以及其它 Unicode 换行符都视为行尾
     """
+    tail = b''
+    for chunk in chunks:
+        data = tail + chunk
+        # 块末尾的 \r 可能与下一块开头的 \n 组成 \r\n，留到下一块处理
+        body = data[:-1] if data.endswith(b'\r') else data
+        cut = max(body.rfind(b'\n'), body.rfind(b'\r'))
+        if cut < 0:
+            tail = data
+            continue
+        tail = data[cut + 1:]
+        yield from _split_raw_lines(body[:cut + 1])
+    if tail:
+        yield from _split_raw_lines(tail)
+
+def iter_base64_decoded(chunks):
+    """流式 Base64 解码：按 4 字节对齐分段解码"""
+    pending = b''
+    for chunk in chunks:
+        data = pending + chunk.translate(None, b' \t\r\n')
+        cut = len(data) - len(data) % 4
+        if cut:
+            yield base64.b64decode(data[:cut], validate=True)
+        pending = data[cut:]
+    if pending:
+        yield base64.b64decode(pending, validate=True)
+
+def sniff_base64(prefix, complete):
+    """只根据有界前缀判断整份内容是否为 Base64 编码"""
+    s = prefix.strip().replace(b'\n', b'').replace(b'\r', b'')
+    if b' ' in s or not B64_ALPHABET.match(s): return False
+    if complete and len(s) < 20: return False
+    sample = s[:len(s) - len(s) % 4] if not complete else s
+    try:
+        decoded = base64.b64decode(sample, validate=True)
+    except (binascii.Error, ValueError):
+        return False
+    return is_text_data(safe_decode(decoded))
+
+def parse_stream(chunks):
+    """流式解析器：逐块读取字节流并产出规则条目，内存占用与文件大小无关"""
+    chunks = iter(chunks)
+    prefix = b''
+    complete = True
+    for chunk in chunks:
+        prefix += chunk
+        if len(prefix) >= SNIFF_BYTES:
+            complete = False
+            break
+
+    def replay():
+        yield prefix
+        yield from chunks
+
+    source = replay()
+    if sniff_base64(prefix, complete):
+        source = iter_base64_decoded(source)
+    return iter_entries(iter_text_lines(source))
+
+def _normalize_domain_slow(s):
+    """完整清洗路径：处理 hosts / AdGuard / 通配符等复杂写法"""
+    if s.startswith('@@'): return None
+
+    m = DOMAIN_PREFIX.match(s)
+    if m: s = s[m.end():]
+
+    parts = s.split()
+    if len(parts) >= 2:
+        if parts[0] in ['127.0.0.1', '0.0.0.0', '::1']:
+            s = parts[1]
+
+    if s.startswith('||'): s = s[2:]
+    if s.endswith('^'): s = s[:-1]
+    if '$' in s: s = s.split('$')[0]
+    s = DOMAIN_WILDCARD.sub('', s, count=1)
+    if '/' in s: s = s.split('/')[0]
+    if ':' in s: s = s.split(':')[0]
+    if not s or '.' not in s: return None
+    if ' ' in s: return None
+    if IPV4_CHECK.match(s): return None
+    if s.isascii():
+        if not DOMAIN_CHARSET.fullmatch(s): return None
+    elif not all(c.isalnum() or c in '-._' for c in s):
+        return None
+    return s
+
+def _normalize_domains(lines):
+    """域名清洗核心：返回去重集合，串行与多进程路径共用"""
     valid_domains = set()
-    ip_check = re.compile(r'^\d{1,3}(\.\d{1,3}){3}$')
-    
-    prefixes = [
-        'full:', 'domain:', 'host:', 'keyword:', 'regexp:', 
-        'domain-suffix:', 'domain-keyword:', '+.'
-    ]
-    
+    fast_match = DOMAIN_FAST.fullmatch
+    ip_match = IPV4_CHECK.match
+    slow = _normalize_domain_slow
+
     for item in lines:
         s = item.lower().strip()
         if not s: continue
-        
-        if s.startswith('@@'): continue
-        
-        for prefix in prefixes:
-            if s.startswith(prefix):
-                s = s[len(prefix):]
-                break
-
-        parts = s.split()
-        if len(parts) >= 2:
-            if parts[0] in ['127.0.0.1', '0.0.0.0', '::1']:
-                s = parts[1]
-        
-        if s.startswith('||'): s = s[2:]
-        if s.endswith('^'): s = s[:-1]
-        if '$' in s: s = s.split('$')[0]
-        s = re.sub(r'^(\*\.|\+\.|\.)', '', s)
-        if '/' in s: s = s.split('/')[0]
-        if ':' in s: s = s.split(':')[0]
-        if not s or '.' not in s: continue
-        if ' ' in s: continue
-        if ip_check.match(s): continue
-        if not all(c.isalnum() or c in '-._' for c in s): continue
-        
+
+        m = fast_match(s)
+        if m:
+            s = m.group(1)
+            if '.' not in s or ip_match(s): continue
+        else:
+            s = slow(s)
+            if s is None: continue
+
         valid_domains.add(s)
-        
-    return sorted(list(valid_domains))
+
+    return valid_domains
+
+def _normalize_domain_batch(lines):
+    """进程池中的批次：清洗后转为 DomainSet，回传给主进程的只是一段字节串和偏移数组"""
+    return DomainSet.from_iterable(_normalize_domains(lines))
+
+_POOL = None
+_POOL_WORKERS = 0
+
+def get_process_pool(workers):
+    """懒加载进程池 (spawn 方式，避免在下载线程存活时 fork)"""
+    global _POOL, _POOL_WORKERS
+    if _POOL is None or _POOL_WORKERS != workers:
+        shutdown_process_pool()
+        _POOL = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        _POOL_WORKERS = workers
+    return _POOL
+
+def shutdown_process_pool():
+    global _POOL
+    if _POOL is not None:
+        _POOL.shutdown(wait=True)
+        _POOL = None
+
+atexit.register(shutdown_process_pool)
+
+def iter_batches(lines, size):
+    batch = []
+    for item in lines:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def process_domain(lines, workers=None):
+    """
+    智能域名清洗 (已修复 full: 等前缀问题)
+    常见写法走预编译正则快路径，其余回退到完整清洗路径，输出完全一致；
+    条目数超过 PARALLEL_THRESHOLD 时自动分块交给进程池并行清洗
+    返回有序的 DomainSet (可迭代、可取长度，顺序与 sorted() 相同)
+    """
+    if workers is None:
+        workers = PARALLEL_WORKERS
+    with instrument.span("process_domain"):
+        lines = iter(lines)
+        head = list(islice(lines, PARALLEL_THRESHOLD))
+
+        if workers <= 1 or len(head) < PARALLEL_THRESHOLD:
+            return DomainSet.from_iterable(_normalize_domains(chain(head, lines)))
+
+        pool = get_process_pool(workers)
+        futures = [pool.submit(_normalize_domain_batch, batch)
+                   for batch in iter_batches(chain(head, lines), PARALLEL_BATCH)]
+        instrument.count("domain_batches", len(futures))
+        return DomainSet.union_of(future.result() for future in futures)
 
 def process_ip(lines):
-    """智能 IP 清洗"""
-    v4_nets = []
-    v6_nets = []
+    """智能 IP 清洗 (整数区间引擎，结果与 collapse_addresses 一致)"""
+    ranges = cidr.RangeSet()
     regex_ip = re.compile(r'([0-9a-fA-F:.]+(?:/[0-9]+)?)')
     
-    for item in lines:
-        m = regex_ip.search(item)
-        if not m: continue
-        ip_str = m.group(1)
-        try:
-            net = ipaddress.ip_network(ip_str, strict=False)
-            if net.prefixlen == 0: continue 
-            if net.version == 4:
-                v4_nets.append(net)
-            else:
-                v6_nets.append(net)
-        except ValueError:
-            continue
-            
-    merged_v4 = ipaddress.collapse_addresses(v4_nets)
-    merged_v6 = ipaddress.collapse_addresses(v6_nets)
-    
-    final_list = []
-    final_list.extend(str(n) for n in merged_v4)
-    final_list.extend(str(n) for n in merged_v6)
-    
-    return final_list
+    with instrument.span("process_ip"):
+        for item in lines:
+            m = regex_ip.search(item)
+            if not m: continue
+            try:
+                version, start, end, prefixlen = cidr.parse_cidr(m.group(1))
+            except ValueError:
+                continue
+            if prefixlen == 0: continue
+            ranges.add(version, start, end)
+
+        with instrument.span("collapse"):
+            return ranges.to_cidrs()
 
 def main():
     mode = "domain"
     if len(sys.argv) > 1:
         mode = sys.argv[1]
         
-    try:
-        raw_bytes = sys.stdin.buffer.read()
-    except Exception:
-        return
-
-    if not raw_bytes:
-        return
-
-    content = safe_decode(raw_bytes)
-    lines = parse_lines(content)
+    lines = parse_stream(iter_chunks(sys.stdin.buffer))
     
     if mode == 'ipcidr':
         result = process_ip(lines)
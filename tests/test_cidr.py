@@ -0,0 +1,69 @@
+import ipaddress
+import random
+
+import pytest
+
+from processor import process_ip
+
+
+def collapse_reference(lines):
+    """原先基于 ipaddress.collapse_addresses 的 process_ip"""
+    import re
+    nets = {4: [], 6: []}
+    for item in lines:
+        m = re.search(r'([0-9a-fA-F:.]+(?:/[0-9]+)?)', item)
+        if not m:
+            continue
+        try:
+            net = ipaddress.ip_network(m.group(1), strict=False)
+        except ValueError:
+            continue
+        if net.prefixlen == 0:
+            continue
+        nets[net.version].append(net)
+    return [str(n) for v in (4, 6) for n in ipaddress.collapse_addresses(nets[v])]
+
+
+TABLE = [
+    # 重叠 / 包含
+    ["10.0.0.0/8", "10.1.0.0/16", "10.1.2.3/32"],
+    # 相邻且可合并
+    ["192.168.0.0/25", "192.168.0.128/25", "192.168.1.0/24"],
+    # 相邻但不对齐，不能合并为单个前缀
+    ["192.168.1.0/24", "192.168.2.0/24"],
+    # 主机位非零
+    ["10.0.0.77/24", "172.16.5.9/12", "2001:db8::1/32", "2001:db8:1:2::ff/64"],
+    # v4 与 v6 混合、各种写法
+    ["IP-CIDR,1.1.1.0/24,no-resolve", "IP-CIDR6,2606:4700::/32", "- '8.8.8.8'", "::ffff:1.2.3.4/128",
+     "2001:DB8::/48", "2001:db8:0:0:0:0:0:1", "1.2.3.4"],
+    # 无效与被忽略的条目
+    ["0.0.0.0/0", "::/0", "256.1.1.1/24", "1.2.3.4/33", "2001:db8::/129", "01.2.3.4", "example.com", "", "# 1.2.3.4",
+     "1.2.3", ":::1", "1::2::3"],
+    # 边界地址
+    ["0.0.0.0/1", "128.0.0.0/1", "255.255.255.255", "::/1", "8000::/1", "ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff"],
+]
+
+
+@pytest.mark.parametrize("lines", TABLE)
+def test_process_ip_table(lines):
+    assert process_ip(lines) == collapse_reference(lines)
+
+
+def random_network(rng):
+    if rng.random() < 0.6:
+        # 集中在少量 /16 内，制造大量重叠与相邻
+        addr = (rng.choice([10, 172, 192]) << 24) | (rng.randrange(4) << 16) | rng.getrandbits(16)
+        text = str(ipaddress.IPv4Address(addr))
+        prefix = rng.randint(8, 32)
+    else:
+        addr = (0x20010db8 << 96) | (rng.randrange(4) << 80) | rng.getrandbits(80)
+        text = str(ipaddress.IPv6Address(addr))
+        prefix = rng.randint(16, 128)
+    return text if rng.random() < 0.1 else f"{text}/{prefix}"
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_process_ip_random(seed):
+    rng = random.Random(seed)
+    lines = [random_network(rng) for _ in range(rng.randint(1, 400))]
+    assert process_ip(lines) == collapse_reference(lines)
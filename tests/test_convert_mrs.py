@@ -0,0 +1,60 @@
+import gzip
+import hashlib
+
+import pytest
+
+import convert_mrs
+
+KERNEL = b"\x7fELF fake mihomo kernel"
+ARCHIVE = gzip.compress(KERNEL)
+TAG = "v1.19.0"
+URL = convert_mrs.PINNED_URL.format(tag=TAG)
+
+
+class Response:
+    def __init__(self, data=b"", payload=None):
+        self.data = data
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+    def iter_content(self, size):
+        yield self.data
+
+
+def fake_github(monkeypatch, digest):
+    asset = {"name": f"mihomo-linux-amd64-{TAG}.gz", "browser_download_url": URL, "digest": digest}
+
+    def get(url, headers=None, stream=False):
+        if url == convert_mrs.TAG_API.format(tag=TAG):
+            return Response(payload={"tag_name": TAG, "assets": [asset]})
+        assert url == URL
+        return Response(ARCHIVE)
+
+    monkeypatch.setattr(convert_mrs.requests, "get", get)
+
+
+def pinned_release():
+    return {"tag_name": TAG, "download_url": URL, "sha256": None, "pinned": True}
+
+
+def test_pinned_download_verifies_published_checksum(monkeypatch, tmp_path):
+    monkeypatch.setattr(convert_mrs, "KERNEL_CACHE_DIR", str(tmp_path))
+    fake_github(monkeypatch, "sha256:" + hashlib.sha256(ARCHIVE).hexdigest())
+    binary = convert_mrs.download_kernel(pinned_release())
+    with open(binary, "rb") as f:
+        assert f.read() == KERNEL
+    assert convert_mrs.cached_kernel(TAG) == binary
+
+
+@pytest.mark.parametrize("digest", ["sha256:" + "0" * 64, None])
+def test_pinned_download_rejects_bad_or_missing_checksum(monkeypatch, tmp_path, digest):
+    monkeypatch.setattr(convert_mrs, "KERNEL_CACHE_DIR", str(tmp_path))
+    fake_github(monkeypatch, digest)
+    with pytest.raises(Exception):
+        convert_mrs.download_kernel(pinned_release())
+    assert convert_mrs.cached_kernel(TAG) is None
@@ -0,0 +1,13 @@
+import pytest
+
+from domainset import ITER_BLOCK, DomainSet
+
+
+@pytest.mark.parametrize("n", [1, ITER_BLOCK - 1, ITER_BLOCK, ITER_BLOCK + 1, 3 * ITER_BLOCK])
+def test_from_unique_list_across_join_blocks(n):
+    items = [b"%07d.example.com" % i for i in range(n)]
+    ds = DomainSet.from_unique_list(items)
+    assert ds.blob == b"\n".join(items) + b"\n"
+    assert len(ds) == n
+    assert list(ds.iter_bytes()) == items
+    assert items[-1].decode() in ds
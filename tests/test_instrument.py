@@ -0,0 +1,19 @@
+import instrument
+
+
+def test_worker_state_merges_under_parent_span():
+    instrument.export_state()
+    with instrument.span("read", key="a.txt"):
+        pass
+    instrument.count("rules_in", 3)
+    worker = instrument.export_state()
+    assert instrument.export_state()["spans"] == {}
+
+    with instrument.span("merge"):
+        instrument.merge_state(worker)
+        instrument.merge_state(worker)
+    data = instrument.snapshot("test")
+    assert data["spans"]["merge/read"]["calls"] == 2
+    assert data["counters"]["rules_in"] == 6
+    assert [e["span"] for e in data["events"]] == ["merge/read", "merge/read"]
+    instrument.export_state()
@@ -0,0 +1,161 @@
+import random
+
+import pytest
+
+import instrument
+import merger
+from domainset import DomainSet
+
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    src = tmp_path / "rulesets"
+    src.mkdir()
+    monkeypatch.setattr(merger, "SOURCE_DIR", str(src))
+    (src / "a.txt").write_text("a.com\nc.com\n", encoding="utf-8")
+    (src / "b.txt").write_text("b.com\nc.com\nd.com\n", encoding="utf-8")
+    (src / "u.txt").write_text("z.com\na.com\n", encoding="utf-8")
+    return tmp_path
+
+
+def strip_date(data):
+    return b"".join(l for l in data.splitlines(keepends=True) if not l.startswith(b"# Date:"))
+
+
+@pytest.mark.parametrize("rule_type,filename,files", [
+    ("domain", "o.txt", {"a.txt": "a.com\nc.com\n", "b.txt": "b.com\nc.com\nd.com\n"}),
+    ("ip", "o.txt", {"a.txt": "10.0.0.0/25\n192.168.1.0/24\n2001:db8::/33\n",
+                     "b.txt": "10.0.0.128/25\n192.168.1.0/24\n2001:db8:8000::/33\n"}),
+    ("domain", "empty.txt", {"a.txt": "", "b.txt": ""}),
+])
+def test_stream_task_matches_render_output(sources, rule_type, filename, files):
+    for name, text in files.items():
+        (sources / "rulesets" / name).write_text(text, encoding="utf-8")
+    out = sources / "staging" / filename
+    mode, opt, raw = merger.stream_task("s", rule_type, "me", filename, list(files), "描述", str(out))
+
+    merged = merger.merge_task_rules(rule_type, filename, list(files), prune=False)
+    m_mode, final_list, m_raw, pruned, _ = merged
+    expected = merger.render_output("s", rule_type, "me", m_mode, final_list, m_raw, pruned, "描述")
+    assert (mode, opt, raw) == (m_mode, len(final_list), m_raw)
+    assert strip_date(out.read_bytes()) == strip_date(expected.encode("utf-8"))
+    assert not list((sources / "staging").glob("*.tmp"))
+
+
+def test_stream_task_unsorted_leaves_no_output(sources):
+    out = sources / "staging" / "o.txt"
+    with pytest.raises(merger.UnsortedInput):
+        merger.stream_task("s", "domain", "me", "o.txt", ["a.txt", "u.txt"], "desc", str(out))
+    assert not out.exists()
+
+
+def prune_str(domains):
+    """原先基于 str 的实现，作为参照"""
+    keys = sorted(d[::-1] + '.' for d in domains)
+    kept = []
+    parent = None
+    for key in keys:
+        if parent is not None and key.startswith(parent):
+            continue
+        parent = key
+        kept.append(key[-2::-1])
+    return sorted(kept)
+
+
+def test_prune_domainset_matches_str_implementation():
+    rng = random.Random(25)
+    labels = ["a", "b", "ab", "a-b", "xn--p1ai", "cdn", "www", "0"]
+    domains = {".".join(rng.choice(labels) for _ in range(rng.randint(1, 4))) + rng.choice([".com", ".org", ""])
+               for _ in range(5000)}
+    domains |= {"com", "a.com", "b.a.com", "a-b.com", "ab.com", "x.ab.com"}
+    ds = DomainSet.from_iterable(domains)
+    pruned = merger.prune_covered_domains(ds)
+    assert isinstance(pruned, DomainSet)
+    assert list(pruned) == prune_str(domains)
+    assert list(merger.prune_covered_domains(set(domains))) == prune_str(domains)
+    assert merger.prune_covered_domains(DomainSet.from_iterable(["a.com", "b.org"])) == \
+        DomainSet.from_iterable(["a.com", "b.org"])
+
+
+def read_lines_reference(path):
+    """原先的逐行读取 (文本模式，通用换行)"""
+    rules = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#') or line.startswith('//'): continue
+            if '#' in line: line = line.split('#')[0].strip()
+            rules.add(line)
+    return sorted(rules)
+
+
+BULK_INPUTS = {
+    "sorted": b"a.com\nb.com\nc.com\n",
+    "no_trailing_newline": b"a.com\nb.com\nc.com",
+    "crlf": b"b.com\r\na.com\r\n\r\nc.com\r\n",
+    "cr_only": b"b.com\ra.com\rc.com",
+    "duplicates": b"b.com\na.com\nb.com\na.com\n",
+    "comments": b"# header\n// note\na.com # inline\n  b.com  \n\tc.com\t\n#x\nd.com#tail\n//e.com\n",
+    "unicode": "münchen.de\n例子.cn\nb.com # 注释\n".encode("utf-8"),
+    "control": b"a.com\x1c\nb.com\x0b\n\x0cc.com\n",
+    "blank_only": b"\n\n  \n",
+    "empty": b"",
+}
+
+
+@pytest.mark.parametrize("name", sorted(BULK_INPUTS))
+@pytest.mark.parametrize("chunk", [None, 7])
+def test_bulk_rules_matches_line_reader(tmp_path, monkeypatch, name, chunk):
+    if chunk is not None:
+        monkeypatch.setattr(merger.iter_line_chunks, "__defaults__", (chunk,))
+    path = tmp_path / "in.txt"
+    path.write_bytes(BULK_INPUTS[name])
+    expected = read_lines_reference(path)
+    with merger.map_file(str(path)) as buf:
+        assert list(merger.bulk_rules(buf)) == expected
+    assert list(merger.bulk_rules(BULK_INPUTS[name])) == expected
+
+
+STREAM_CASES = {
+    "duplicates_across_inputs": ("domain", {"a.txt": b"a.com\nc.com\n", "b.txt": b"b.com\nc.com\nd.com\n",
+                                            "c.txt": b"a.com\nd.com\n"}, True),
+    "no_trailing_newline": ("domain", {"a.txt": b"a.com\nc.com", "b.txt": b"b.com\nc.com"}, True),
+    "ip_overlap": ("ip", {"a.txt": b"10.0.0.0/25\n10.0.0.0/8\n2001:db8::/32",
+                          "b.txt": b"10.0.0.128/25\n192.168.1.0/24\n2001:db8::/48\n"}, True),
+    "crlf": ("domain", {"a.txt": b"a.com\r\nc.com\r\n", "b.txt": b"b.com\r\n"}, False),
+    "unsorted_first": ("domain", {"a.txt": b"z.com\na.com\n", "b.txt": b"b.com\n"}, False),
+    "unsorted_later": ("domain", {"a.txt": b"a.com\nb.com\nc.com\n", "b.txt": b"d.com\ne.com\nb.com\n"}, False),
+    "ip_unsorted": ("ip", {"a.txt": b"10.0.0.0/8\n1.0.0.0/8\n", "b.txt": b"2.0.0.0/8\n"}, False),
+}
+
+
+@pytest.mark.parametrize("name", sorted(STREAM_CASES))
+def test_streamed_merge_matches_set_merge(tmp_path, monkeypatch, name):
+    rule_type, files, streams = STREAM_CASES[name]
+    src = tmp_path / "rulesets"
+    src.mkdir()
+    for fname, data in files.items():
+        (src / fname).write_bytes(data)
+    monkeypatch.setattr(merger, "SOURCE_DIR", str(src))
+
+    def run(stream):
+        staging = tmp_path / ("stream" if stream else "set")
+        monkeypatch.setattr(merger, "STAGING_DIR", str(staging))
+        monkeypatch.setattr(merger, "STREAM_MERGE", stream)
+        instrument.export_state()
+        stats = merger.process_task_logic("s", rule_type, "me", "o.txt", list(files), "描述", prune=False)
+        counters = instrument.export_state()["counters"]
+        return stats, (staging / "s" / rule_type / "me" / "o.txt").read_bytes(), counters
+
+    streamed, out, counters = run(True)
+    merged, expected, _ = run(False)
+    assert streamed == merged
+    assert strip_date(out) == strip_date(expected)
+    assert counters.get("streamed_tasks", 0) == int(streams)
+    assert counters.get("stream_fallbacks", 0) == int(not streams)
+
+    if not streams:
+        partial = tmp_path / "partial" / "o.txt"
+        with pytest.raises(merger.UnsortedInput):
+            merger.stream_task("s", rule_type, "me", "o.txt", list(files), "描述", str(partial))
+        assert not partial.exists()
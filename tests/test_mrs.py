@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+import mrs
+
+pytest.importorskip("zstandard")
+
+# 参考文件由 mihomo convert-ruleset 生成，原生编码器必须逐字节一致
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "mrs")
+SRC_ROOT = os.path.join(FIXTURES, "merged-rules")
+MRS_ROOT = os.path.join(FIXTURES, "merged-rules-mrs")
+
+def reference_pairs():
+    for root, _, files in os.walk(MRS_ROOT):
+        for f in sorted(files):
+            rel = os.path.relpath(os.path.join(root, f), MRS_ROOT)
+            yield os.path.splitext(rel)[0]
+
+@pytest.mark.parametrize("rel", sorted(reference_pairs()))
+def test_payload_matches_mihomo(rel):
+    rule_type = "ipcidr" if "ipcidr" in rel.split(os.sep) else "domain"
+    rules = mrs.read_text_rules(os.path.join(SRC_ROOT, rel + ".txt"))
+    expected = mrs.read_payload(os.path.join(MRS_ROOT, rel + ".mrs"))
+    assert mrs.build_payload(rule_type, rules) == expected
+
+def test_verify_fixtures():
+    assert mrs.verify(SRC_ROOT, MRS_ROOT)
+
+def test_verify_reports_mismatch(tmp_path):
+    rel = os.path.join("direct", "domain", "Loyalsoldier")
+    src = tmp_path / "merged-rules" / rel
+    src.mkdir(parents=True)
+    (src / "private.txt").write_text("+.example.com\n", encoding="utf-8")
+    assert not mrs.verify(str(tmp_path / "merged-rules"), MRS_ROOT)
@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+import orchestrator
+
+
+class RecordingBackend(orchestrator.FakeBackend):
+    """记录每个工作流的派发时刻，用于检查 needs 顺序"""
+
+    def __init__(self, plan=()):
+        super().__init__(plan)
+        self.dispatched = {}
+
+    def dispatch(self, workflow_file, token):
+        self.dispatched[workflow_file] = time.monotonic()
+        super().dispatch(workflow_file, token)
+
+
+def step(id, needs=(), **fake):
+    fake.setdefault('dispatch_delay', 0)
+    fake.setdefault('duration', 0.05)
+    return {"id": id, "name": id, "filename": f"{id}.yml", "needs": list(needs), "fake": fake}
+
+
+def run_plan(plan):
+    plan = orchestrator.normalize_plan(plan)
+    backend = RecordingBackend(plan)
+    results = orchestrator.schedule(plan, lambda task, res: orchestrator.run_remote(backend, task, res),
+                                    time.time())
+    return {r['id']: r for r in results}, backend
+
+
+def test_needs_ordering_and_failure_propagation():
+    results, backend = run_plan([
+        step("sync"),
+        step("merge", ["sync"]),
+        step("convert", ["merge"], conclusion="failure"),
+        step("readme", ["convert"]),
+        step("release", ["merge"]),
+    ])
+    assert {k: r['status'] for k, r in results.items()} == {
+        "sync": "success", "merge": "success", "convert": "failure",
+        "readme": "skipped", "release": "success",
+    }
+    assert "readme.yml" not in backend.dispatched
+    completed = {run['workflow']: run['completed_at'] for run in backend.runs.values()}
+    for id, res in results.items():
+        for need in res['needs']:
+            if res['status'] != 'skipped':
+                assert backend.dispatched[f"{id}.yml"] >= completed[f"{need}.yml"]
+
+
+def test_independent_steps_run_concurrently():
+    results, backend = run_plan([step("a", duration=0.3), step("b", duration=0.3), step("c", ["a", "b"])])
+    assert all(r['status'] == 'success' for r in results.values())
+    assert abs(backend.dispatched["a.yml"] - backend.dispatched["b.yml"]) < 0.2
+
+
+def test_run_timeout_fails_node():
+    plan = [step("slow", duration=30), step("after", ["slow"])]
+    plan[0]['timeout'] = 0.1
+    results, _ = run_plan(plan)
+    assert results['slow']['status'] == 'failure'
+    assert results['after']['status'] == 'skipped'
+
+
+def test_backend_must_implement_interface():
+    class Incomplete(orchestrator.RunBackend):
+        def dispatch(self, workflow_file, token):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+import instrument
+import processor
+from benchmark import legacy_process_domain
+from processor import iter_text_lines, parse_lines, parse_stream
+
+SAMPLES = [
+    b"a.com\rb.com\rc.com",
+    b"a.com\r\nb.com\r\n\r\nc.com\r\n",
+    b"a.com\nb.com\r\rc.com\r",
+    b"# comment\r- DOMAIN-SUFFIX,a.com\r0.0.0.0 b.com\r",
+    "中文.com b.com\x0cc.com\x85d.com".encode("utf-8"),
+]
+
+def split_every(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+@pytest.mark.parametrize("data", SAMPLES)
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 1 << 16])
+def test_iter_text_lines_matches_splitlines(data, size):
+    expected = [l for l in data.decode("utf-8").splitlines() if l]
+    got = [l for l in iter_text_lines(split_every(data, size)) if l]
+    assert got == expected
+
+def test_cr_only_input():
+    data = b"DOMAIN,a.com\rDOMAIN-SUFFIX,b.com\r+.c.com\r"
+    assert list(parse_stream(split_every(data, 4))) == parse_lines(data.decode("utf-8"))
+    assert [l for l in iter_text_lines([data]) if l] == ["DOMAIN,a.com", "DOMAIN-SUFFIX,b.com", "+.c.com"]
+
+def test_crlf_split_across_chunks():
+    assert list(iter_text_lines([b"a.com\r", b"\nb.com"])) == ["a.com", "b.com"]
+
+
+DOMAIN_LINES = [
+    "example.com", "Example.COM", "  sub.Example.com  ", "+.plus.example.org", "*.wild.example.net",
+    ".dot.example.io", "full:Full.example.com", "domain:d.example.com", "host:h.example.com",
+    "domain-suffix:ds.example.com", "DOMAIN-SUFFIX:upper.example.com", "keyword:kw.example.com",
+    "regexp:re.example.com", "domain-keyword:dk.example.com", "0.0.0.0 hosts.example.com",
+    "127.0.0.1 localhost.example.com", "::1 v6host.example.com", "||adguard.example.com^",
+    "||opts.example.com^$third-party", "@@||allow.example.com^", "path.example.com/ads",
+    "port.example.com:8080", "# comment.example.com", "! adblock comment", "1.2.3.4", "10.0.0.1",
+    "localhost", "", "   ", "has space.example.com x y", "bad_char!.example.com", "münchen.example.de",
+    "xn--mnchen-3ya.example.de", "under_score.example.com", "-dash-.example.com", "a..b.example.com",
+    "+.", "*.", "full:", "example.com.",
+]
+
+
+def random_domain_lines(n, seed=5):
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        line = rng.choice(DOMAIN_LINES)
+        if line and rng.random() < 0.7 and not line.startswith(("#", "!")):
+            line = line.replace("example", f"ex{rng.randrange(n // 3 or 1)}")
+        out.append(line.upper() if rng.random() < 0.1 else line)
+    return out
+
+
+def test_domain_fast_path_matches_slow_path():
+    for line in DOMAIN_LINES + random_domain_lines(2000):
+        s = line.lower().strip()
+        expected = set()
+        if s:
+            slow = processor._normalize_domain_slow(s)
+            if slow is not None:
+                expected.add(slow)
+        assert processor._normalize_domains([line]) == expected, line
+
+
+def test_process_domain_serial_matches_legacy():
+    lines = DOMAIN_LINES + random_domain_lines(5000)
+    assert list(processor.process_domain(lines, workers=1)) == legacy_process_domain(lines)
+
+
+def test_process_domain_pool_matches_serial():
+    lines = random_domain_lines(processor.PARALLEL_THRESHOLD + processor.PARALLEL_BATCH // 2)
+    batches = instrument.snapshot("test")["counters"].get("domain_batches", 0)
+    try:
+        parallel = processor.process_domain(lines, workers=2)
+    finally:
+        processor.shutdown_process_pool()
+    assert instrument.snapshot("test")["counters"]["domain_batches"] - batches == 3
+    serial = processor.process_domain(lines, workers=1)
+    assert parallel == serial
+    assert list(serial) == legacy_process_domain(lines)